@@ -0,0 +1,72 @@
+"""Blacklist / blocked-sentence matching: per-entry loop vs. the phrase matcher.
+
+Run from the repository root:  python benchmarks/bench_phrase_filter.py
+"""
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep the session in memory and the log/database files out of the working tree
+os.environ.setdefault("FORWARDBOT_SESSION", "")
+os.chdir(tempfile.mkdtemp(prefix="forwardbot-bench-"))
+
+import bot
+
+PATTERN_COUNTS = [10, 1000, 50000]
+MESSAGE_WORDS = 120  # roughly a long channel post
+
+
+def random_word(rng, low=4, high=10):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(low, high)))
+
+
+def legacy_filter(text, blacklist, blocked_sentences):
+    should_block, _ = bot.check_blocked_sentences(text, blocked_sentences)
+    if should_block:
+        return None
+    return bot.filter_blacklisted_words(text, blacklist)
+
+
+def matcher_filter(text, matcher):
+    blocked_sentence, spans = bot.scan_phrases(matcher, text)
+    if blocked_sentence is not None:
+        return None
+    return bot.mask_spans(text, spans)
+
+
+def main():
+    rng = random.Random(42)
+    print(f"{'patterns':>9} {'build ms':>10} {'loop us':>10} {'find us':>10} {'automaton us':>13}")
+    for count in PATTERN_COUNTS:
+        blacklist = [random_word(rng) for _ in range(count // 2)]
+        blocked_sentences = [f"{random_word(rng)} {random_word(rng)}" for _ in range(count - count // 2)]
+        words = [random_word(rng) for _ in range(MESSAGE_WORDS)]
+        words[rng.randrange(MESSAGE_WORDS)] = blacklist[0]  # one hit, no blocked sentence
+        text = " ".join(words)
+
+        # Force each engine regardless of PHRASE_AUTOMATON_THRESHOLD
+        bot.PHRASE_AUTOMATON_THRESHOLD = float('inf')
+        find_matcher = bot.build_phrase_matcher(blacklist, blocked_sentences)
+        bot.PHRASE_AUTOMATON_THRESHOLD = 0
+        start = time.perf_counter()
+        automaton = bot.build_phrase_matcher(blacklist, blocked_sentences)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        expected = legacy_filter(text, blacklist, blocked_sentences)
+        assert matcher_filter(text, find_matcher) == expected
+        assert matcher_filter(text, automaton) == expected
+
+        runs = max(20000 // count, 3)
+        loop_us = timeit.timeit(lambda: legacy_filter(text, blacklist, blocked_sentences), number=runs) / runs * 1e6
+        find_us = timeit.timeit(lambda: matcher_filter(text, find_matcher), number=runs) / runs * 1e6
+        auto_us = timeit.timeit(lambda: matcher_filter(text, automaton), number=500) / 500 * 1e6
+        print(f"{count:>9} {build_ms:>10.1f} {loop_us:>10.1f} {find_us:>10.1f} {auto_us:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
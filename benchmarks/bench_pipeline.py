@@ -0,0 +1,238 @@
+"""End-to-end forwarding pipeline against an in-process fake client, no network.
+
+Events go through the real Telethon handlers (forward_messages,
+handle_message_edit, handle_message_deleted), source workers, filters,
+the send scheduler and the message store. Per-destination and account
+rate limits are lifted so the numbers show the bot's own overhead.
+
+Run from the repository root:  python benchmarks/bench_pipeline.py [--scenario NAME] [--memory]
+"""
+import argparse
+import asyncio
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+# Keep the session in memory and the log/database files out of the working tree
+os.environ.setdefault("FORWARDBOT_SESSION", "")
+WORK_DIR = tempfile.mkdtemp(prefix="forwardbot-bench-")
+os.chdir(WORK_DIR)
+
+import bot
+from fake_telegram import FakeClient, make_delete_event, make_event, make_message
+
+SOURCE_BASE = -1001000000000
+DESTINATION_BASE = -1002000000000
+
+
+def tune_bot():
+    bot.logger.disabled = True
+    bot.DESTINATION_RATE_LIMIT = bot.GLOBAL_RATE_LIMIT = 1e9
+    bot.DESTINATION_BURST = bot.GLOBAL_BURST = 1e9
+    bot.SOURCE_WORKER_IDLE_TIMEOUT = 0.05
+    bot.ALBUM_BUFFER_SECONDS = 0.05
+    bot.EDIT_COALESCE_SECONDS = 0.05
+    bot.RETRY_DELAY = 0.01
+
+
+def random_word(rng, low=4, high=10):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(low, high)))
+
+
+def message_text(rng, msg_id, words=40, extra=""):
+    return f"[m{msg_id}] " + " ".join(random_word(rng) for _ in range(words)) + extra
+
+
+def build_pairs(pair_count, sources, **config):
+    mappings = {}
+    for i in range(pair_count):
+        mappings.setdefault(str(1000 + i % 5), {})[f"pair{i}"] = {
+            'source': str(SOURCE_BASE - i % sources),
+            'destination': str(DESTINATION_BASE - i),
+            'active': True,
+            'remove_mentions': False,
+            'blacklist': [],
+            'block_urls': False,
+            'blacklist_urls': [],
+            'header_pattern': '',
+            'footer_pattern': '',
+            'custom_header': '',
+            'custom_footer': '',
+            'blocked_sentences': [],
+            **config
+        }
+    return mappings
+
+
+def reset_bot(fake, mappings, run_id):
+    bot.client = fake
+    bot.is_connected = True
+    bot.channel_mappings = mappings
+    for state in (bot.pair_stats, bot.pair_series, bot.filter_plans, bot.source_fingerprints,
+                  bot.reply_targets, bot.pending_edits, bot.pair_json_cache):
+        state.clear()
+    for key in bot.dispatch_stats:
+        bot.dispatch_stats[key] = 0
+    for user_id, pairs in mappings.items():
+        for pair_name in pairs:
+            bot.reset_pair_stats(user_id, pair_name)
+    bot.rebuild_routing_index()
+    bot.rebuild_filter_plans()
+    db_file = os.path.join(WORK_DIR, f"run{run_id}.db")
+    bot.message_store = bot.MessageMappingStore(db_file, bot.MAX_MAPPING_HISTORY)
+    bot.message_store.open()
+    bot.retry_queue = bot.RetryQueue(db_file)
+    bot.retry_queue.open()
+    bot.send_scheduler = bot.SendScheduler()
+    fake.started = time.perf_counter()  # Setup (filter compilation, store creation) is not timed
+
+
+async def wait_idle(timeout=120):
+    """Wait for source workers, coalesced edits and the retry queue to finish."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        others = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        if others:
+            await asyncio.wait(others, timeout=deadline - time.monotonic())
+            continue
+        await bot.retry_queue.refresh_stats()
+        if not bot.retry_queue.depth:
+            return
+        await bot.process_message_queue()
+        await asyncio.sleep(0.02)
+
+
+async def inject_new(fake, chat_id, message):
+    fake.inject(chat_id, message)
+    await bot.forward_messages(make_event(chat_id, message))
+
+
+def pair_total(kind):
+    return sum(stats[kind] for pairs in bot.pair_stats.values() for stats in pairs.values())
+
+
+async def scenario_fanout(pair_count, sources, messages, fake, **config):
+    rng = random.Random(7)
+    reset_bot(fake, build_pairs(pair_count, sources, **config), pair_count)
+    for i in range(messages):
+        await inject_new(fake, SOURCE_BASE - i % sources, make_message(i + 1, message_text(rng, i + 1)))
+    return messages
+
+
+async def scenario_large_blacklist(fake):
+    rng = random.Random(11)
+    blacklist = [random_word(rng) for _ in range(5000)]
+    blocked = [f"{random_word(rng)} {random_word(rng)}" for _ in range(5000)]
+    reset_bot(fake, build_pairs(10, 1, blacklist=blacklist, blocked_sentences=blocked), "blacklist")
+    for i in range(1000):
+        text = message_text(rng, i + 1, extra=f" {rng.choice(blacklist)}")
+        await inject_new(fake, SOURCE_BASE, make_message(i + 1, text))
+    return 1000
+
+
+async def scenario_album_burst(fake):
+    rng = random.Random(13)
+    # A custom header keeps albums off the native forward path, exercising send_file
+    reset_bot(fake, build_pairs(1, 1, custom_header="via bench"), "albums")
+    msg_id = 0
+    for album in range(200):
+        for _ in range(10):
+            msg_id += 1
+            await inject_new(fake, SOURCE_BASE, make_message(msg_id, message_text(rng, msg_id, 5), media=True, grouped_id=album + 1))
+    return msg_id
+
+
+async def scenario_edit_storm(fake):
+    rng = random.Random(17)
+    reset_bot(fake, build_pairs(1, 1, custom_footer="edited"), "edits")
+    for i in range(500):
+        await inject_new(fake, SOURCE_BASE, make_message(i + 1, message_text(rng, i + 1)))
+    await wait_idle()
+    for _ in range(5):
+        for i in range(500):
+            await bot.handle_message_edit(make_event(SOURCE_BASE, make_message(i + 1, message_text(rng, i + 1))))
+    return 3000
+
+
+async def scenario_mass_deletion(fake):
+    rng = random.Random(19)
+    reset_bot(fake, build_pairs(1, 1), "deletes")
+    for i in range(5000):
+        await inject_new(fake, SOURCE_BASE, make_message(i + 1, message_text(rng, i + 1, 5)))
+    await wait_idle()
+    for start in range(0, 5000, 100):
+        await bot.handle_message_deleted(make_delete_event(SOURCE_BASE, range(start + 1, start + 101)))
+    return 5050
+
+
+SCENARIOS = {
+    "1-pair": lambda: scenario_fanout(1, 1, 2000, FakeClient()),
+    "100-pairs": lambda: scenario_fanout(100, 10, 2000, FakeClient()),
+    "5000-pairs": lambda: scenario_fanout(5000, 500, 2000, FakeClient()),
+    "large-blacklist": lambda: scenario_large_blacklist(FakeClient()),
+    "album-burst": lambda: scenario_album_burst(FakeClient()),
+    "edit-storm": lambda: scenario_edit_storm(FakeClient()),
+    "mass-deletion": lambda: scenario_mass_deletion(FakeClient()),
+    "flaky-network": lambda: scenario_fanout(
+        10, 1, 1000, FakeClient(latency=0.005, flood_rate=0.002, flood_seconds=1, disconnect_rate=0.01)
+    ),
+}
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+async def run(name, measure_memory):
+    if measure_memory:
+        tracemalloc.start()
+    injected = await SCENARIOS[name]()
+    await wait_idle()
+    fake = bot.client
+    seconds = time.perf_counter() - fake.started
+    await bot.message_store.flush()
+    source_of = {int(m['destination']): int(m['source']) for pairs in bot.channel_mappings.values() for m in pairs.values()}
+    latencies = fake.latencies(source_of)
+    peak_mb = "n/a"
+    if measure_memory:
+        peak_mb = f"{tracemalloc.get_traced_memory()[1] / 2 ** 20:.1f}"
+        tracemalloc.stop()
+    bot.message_store.close()
+    bot.retry_queue.close()
+    print(
+        f"{name:>16} {injected:>8} {seconds:>8.2f} {injected / seconds:>10.0f} "
+        f"{pair_total('forwarded'):>9} {pair_total('edited'):>7} {pair_total('deleted'):>7} {pair_total('queued'):>6} "
+        f"{percentile(latencies, 0.5) * 1000:>8.1f} {percentile(latencies, 0.95) * 1000:>8.1f} "
+        f"{percentile(latencies, 0.99) * 1000:>8.1f} {fake.flood_waits:>5} {fake.disconnects:>5} {peak_mb:>8}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append",
+                        help="scenario to run (repeatable); default is all")
+    parser.add_argument("--memory", action="store_true", help="trace peak memory (slows the run down)")
+    args = parser.parse_args()
+    tune_bot()
+    print(
+        f"{'scenario':>16} {'events':>8} {'seconds':>8} {'events/s':>10} "
+        f"{'fwd':>9} {'edited':>7} {'deleted':>7} {'queued':>6} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'flood':>5} {'disc':>5} {'peak MB':>8}"
+    )
+    for name in args.scenario or SCENARIOS:
+        await run(name, args.memory)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
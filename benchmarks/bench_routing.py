@@ -0,0 +1,66 @@
+"""Per-event routing cost: legacy nested scan vs. the source routing index.
+
+Run from the repository root:  python benchmarks/bench_routing.py
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep the session in memory and the log/database files out of the working tree
+os.environ.setdefault("FORWARDBOT_SESSION", "")
+os.chdir(tempfile.mkdtemp(prefix="forwardbot-bench-"))
+
+import bot
+
+PAIR_COUNTS = [10, 100, 1000, 5000]
+USERS = 5
+ITERATIONS = 2000
+
+
+def build_mappings(pair_count):
+    mappings = {}
+    for i in range(pair_count):
+        user_id = str(1000 + i % USERS)
+        mappings.setdefault(user_id, {})[f"pair{i}"] = {
+            'source': str(-1001000000000 - i),
+            'destination': str(-1002000000000 - i),
+            'active': True,
+        }
+    return mappings
+
+
+def legacy_scan(chat_id):
+    for user_id, pairs in bot.channel_mappings.items():
+        for pair_name, mapping in pairs.items():
+            if mapping['active'] and chat_id == int(mapping['source']):
+                return user_id, pair_name, mapping
+    return None
+
+
+def indexed_lookup(chat_id):
+    routes = bot.source_routes.get(chat_id)
+    return routes[0] if routes else None
+
+
+def main():
+    bot.logger.disabled = True
+    print(f"{'pairs':>6} {'scan miss':>12} {'index miss':>12} {'scan hit':>12} {'index hit':>12}  (us/event)")
+    for pair_count in PAIR_COUNTS:
+        bot.channel_mappings.clear()
+        bot.channel_mappings.update(build_mappings(pair_count))
+        bot.rebuild_routing_index()
+        miss_id = -1009999999999
+        hit_id = -1001000000000 - (pair_count - 1)  # worst case for the scan
+        results = []
+        for fn, chat_id in ((legacy_scan, miss_id), (indexed_lookup, miss_id),
+                            (legacy_scan, hit_id), (indexed_lookup, hit_id)):
+            iterations = max(ITERATIONS // pair_count, 5) if fn is legacy_scan else ITERATIONS
+            seconds = timeit.timeit(lambda: fn(chat_id), number=iterations)
+            results.append(seconds / iterations * 1e6)
+        print(f"{pair_count:>6} " + " ".join(f"{r:>12.2f}" for r in results))
+
+
+if __name__ == "__main__":
+    main()
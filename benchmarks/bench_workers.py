@@ -0,0 +1,81 @@
+"""Forwarding throughput against the number of filter worker processes (FILTER_WORKERS).
+
+A filter-heavy workload (large blacklists, mention removal, emoji shortcodes,
+long posts) goes through the real handlers and the fake client, once per
+worker count. 0 is the single-process baseline. Scaling is bounded by the
+cores available, which is printed alongside the results.
+
+Run from the repository root:  python benchmarks/bench_workers.py [--workers 0 1 2 4] [--messages 1000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from bench_pipeline import SOURCE_BASE, build_pairs, inject_new, message_text, pair_total, random_word, reset_bot, tune_bot, wait_idle
+
+import bot
+from fake_telegram import FakeClient, make_message
+
+SOURCES = 8
+PAIRS = 32
+EMOJI = [":fire:", ":rocket:", ":chart_increasing:", ":warning:", ":check_mark_button:"]
+
+
+def heavy_pairs(rng):
+    blacklist = [random_word(rng) for _ in range(3000)]
+    blocked = [f"{random_word(rng)} {random_word(rng)}" for _ in range(3000)]
+    return build_pairs(
+        PAIRS, SOURCES, blacklist=blacklist, blocked_sentences=blocked, remove_mentions=True,
+        custom_header=":newspaper: Digest", custom_footer=":link: via bench",
+        header_pattern="Breaking:", footer_pattern="Subscribe"
+    ), blacklist
+
+
+def heavy_text(rng, msg_id, blacklist):
+    words = [random_word(rng) for _ in range(300)]
+    for i in range(0, len(words), 25):
+        words[i] = rng.choice(EMOJI)
+    words[rng.randrange(len(words))] = rng.choice(blacklist)
+    words[rng.randrange(len(words))] = f"@{random_word(rng)}"
+    return "Breaking: " + message_text(rng, msg_id, 0) + " ".join(words) + " Subscribe"
+
+
+async def run(workers, messages):
+    rng = random.Random(23)
+    bot.FILTER_WORKERS = workers
+    bot.start_filter_pool()
+    fake = FakeClient()
+    mappings, blacklist = heavy_pairs(rng)
+    texts = [heavy_text(rng, i + 1, blacklist) for i in range(messages)]
+    reset_bot(fake, mappings, f"workers{workers}")
+    for i, text in enumerate(texts):
+        await inject_new(fake, SOURCE_BASE - i % SOURCES, make_message(i + 1, text))
+    await wait_idle()
+    seconds = time.perf_counter() - fake.started
+    await bot.message_store.flush()
+    bot.message_store.close()
+    bot.retry_queue.close()
+    bot.stop_filter_pool()
+    return seconds, pair_total('forwarded') + pair_total('blocked')
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4], help="worker counts to compare")
+    parser.add_argument("--messages", type=int, default=1000, help="source messages per run")
+    args = parser.parse_args()
+    tune_bot()
+    print(f"CPUs available: {len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()}")
+    print(f"{'workers':>8} {'messages':>9} {'outputs':>8} {'seconds':>8} {'msgs/s':>8} {'speedup':>8}")
+    baseline = None
+    for workers in args.workers:
+        seconds, outputs = await run(workers, args.messages)
+        rate = args.messages / seconds
+        baseline = baseline or rate
+        print(f"{workers:>8} {args.messages:>9} {outputs:>8} {seconds:>8.2f} {rate:>8.1f} {rate / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
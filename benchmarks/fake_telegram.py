@@ -0,0 +1,140 @@
+"""In-process stand-in for the Telegram client, for offline benchmarks.
+
+Messages built by make_message() carry a "[m<id>]" marker in their text so
+the fake client can tell which source message each outgoing call delivers
+and time it against the moment the event was injected.
+"""
+import asyncio
+import random
+import re
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from telethon import errors
+from telethon.tl.types import MessageMediaPhoto
+
+MARKER_PATTERN = re.compile(r'\[m(\d+)\]')
+
+
+def make_message(msg_id, text="", media=False, grouped_id=None, reply_to=None):
+    return SimpleNamespace(
+        id=msg_id,
+        raw_text=text,
+        text=text,
+        message=text,
+        entities=None,
+        media=MessageMediaPhoto(photo=None) if media else None,
+        grouped_id=grouped_id,
+        reply_to=SimpleNamespace(reply_to_msg_id=reply_to) if reply_to else None,
+        silent=False,
+        date=datetime.now(timezone.utc),
+    )
+
+
+def make_event(chat_id, message):
+    return SimpleNamespace(chat_id=chat_id, message=message)
+
+
+def make_delete_event(chat_id, deleted_ids):
+    return SimpleNamespace(chat_id=chat_id, deleted_ids=list(deleted_ids))
+
+
+class FakeClient:
+    """Answers the calls bot.py makes, with simulated latency, FloodWaits and disconnects.
+
+    latency is the mean seconds per call (exponentially distributed),
+    flood_rate/disconnect_rate are per-call probabilities.
+    """
+
+    def __init__(self, latency=0.0, flood_rate=0.0, flood_seconds=1, disconnect_rate=0.0, seed=1):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.disconnect_rate = disconnect_rate
+        self.rng = random.Random(seed)
+        self.connected = True
+        self.started = None  # perf_counter() when the scenario's setup finished
+        self.next_id = 1
+        self.source_messages = {}  # (chat_id, msg_id) -> message, for get_messages
+        self.injected = {}  # (chat_id, msg_id) -> perf_counter() when the event was handed to the bot
+        self.delivered = {}  # (destination, source msg_id) -> perf_counter() of the first delivery
+        self.calls = {}
+        self.flood_waits = 0
+        self.disconnects = 0
+
+    def inject(self, chat_id, message):
+        self.source_messages[(chat_id, message.id)] = message
+        self.injected[(chat_id, message.id)] = time.perf_counter()
+
+    def is_connected(self):
+        return self.connected
+
+    async def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.rng.expovariate(1 / self.latency))
+        if self.flood_rate and self.rng.random() < self.flood_rate:
+            self.flood_waits += 1
+            raise errors.FloodWaitError(request=None, capture=self.flood_seconds)
+        if self.disconnect_rate and self.rng.random() < self.disconnect_rate:
+            self.disconnects += 1
+            raise ConnectionError("simulated disconnect")
+
+    def _sent(self, destination, source_msg_ids):
+        now = time.perf_counter()
+        sent = []
+        for source_msg_id in source_msg_ids:
+            if source_msg_id is not None:
+                self.delivered.setdefault((destination, source_msg_id), now)
+            sent.append(SimpleNamespace(id=self.next_id))
+            self.next_id += 1
+        return sent
+
+    def _marker(self, text):
+        match = MARKER_PATTERN.search(text or "")
+        return int(match.group(1)) if match else None
+
+    async def send_message(self, entity, message="", **kwargs):
+        await self._call('send_message')
+        return self._sent(entity, [self._marker(message)])[0]
+
+    async def send_file(self, entity, file, caption=None, **kwargs):
+        await self._call('send_file')
+        captions = caption if isinstance(caption, list) else [caption] * (len(file) if isinstance(file, list) else 1)
+        sent = self._sent(entity, [self._marker(text) for text in captions])
+        return sent if isinstance(file, list) else sent[0]
+
+    async def forward_messages(self, entity, messages, from_peer=None, **kwargs):
+        await self._call('forward_messages')
+        ids = messages if isinstance(messages, list) else [messages]
+        return self._sent(entity, ids)
+
+    async def edit_message(self, entity, message=None, text=None, **kwargs):
+        await self._call('edit_message')
+        return SimpleNamespace(id=message)
+
+    async def delete_messages(self, entity, message_ids, **kwargs):
+        await self._call('delete_messages')
+        return [SimpleNamespace(pts_count=len(message_ids))]
+
+    async def get_messages(self, entity, ids=None, search=None, limit=None, min_id=0, reverse=False, **kwargs):
+        await self._call('get_messages')
+        if ids is None:
+            if search is not None:
+                return []
+            history = sorted(msg_id for chat_id, msg_id in self.source_messages if chat_id == entity and msg_id > min_id)
+            if not reverse:
+                history.reverse()
+            return [self.source_messages[(entity, msg_id)] for msg_id in history[:limit]]
+        if isinstance(ids, list):
+            return [self.source_messages.get((entity, msg_id)) for msg_id in ids]
+        return self.source_messages.get((entity, ids))
+
+    def latencies(self, source_of):
+        """Seconds from injection to delivery; source_of maps a destination to its source chat."""
+        return [
+            delivered - self.injected[(source_of[destination], msg_id)]
+            for (destination, msg_id), delivered in self.delivered.items()
+            if (source_of.get(destination), msg_id) in self.injected
+        ]
@@ -0,0 +1,83 @@
+"""Replay a recorded update stream (bot.RECORD_FILE) through the real handlers, no network.
+
+Updates are fed to forward_messages / handle_message_edit /
+handle_message_deleted against the fake client, either at the recorded pace
+(scaled by --speed) or as fast as possible (--speed 0). Latency is the bot's
+own source-to-send histogram, so percentiles are bucket upper bounds.
+
+Run from the repository root:
+    python benchmarks/replay.py updates.jsonl --mappings channel_mappings.json [--speed 0]
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+# Paths are made absolute before bench_pipeline moves into its scratch directory
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument("records", type=os.path.abspath, help="JSON-lines file written by the bot's UpdateRecorder")
+parser.add_argument("--mappings", type=os.path.abspath, default="channel_mappings.json",
+                    help="channel mappings the recording was made with")
+parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier; 0 replays as fast as possible")
+parser.add_argument("--latency", type=float, default=0.0, help="mean simulated API latency in seconds")
+parser.add_argument("--flood-rate", type=float, default=0.0, help="probability of a FloodWait per API call")
+parser.add_argument("--disconnect-rate", type=float, default=0.0, help="probability of a dropped call per API call")
+args = parser.parse_args()
+
+from bench_pipeline import pair_total, reset_bot, tune_bot, wait_idle
+
+import bot
+from fake_telegram import FakeClient
+
+
+async def replay():
+    tune_bot()
+    with open(args.mappings, "r") as f:
+        mappings = json.load(f)
+    with open(args.records, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if not records:
+        print("No records to replay.")
+        return
+
+    fake = FakeClient(latency=args.latency, flood_rate=args.flood_rate, disconnect_rate=args.disconnect_rate)
+    reset_bot(fake, mappings, "replay")
+    handlers = {'new': bot.forward_messages, 'edit': bot.handle_message_edit, 'delete': bot.handle_message_deleted}
+    first = records[0]['t']
+    behind = 0.0
+    for record in records:
+        if args.speed:
+            delay = (record['t'] - first) / args.speed - (time.perf_counter() - fake.started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                behind = max(behind, -delay)
+        kind, event = bot.decode_update(record)
+        if kind != 'delete':
+            fake.inject(event.chat_id, event.message)
+        await handlers[kind](event)
+    fed = time.perf_counter() - fake.started
+    await wait_idle()
+    seconds = time.perf_counter() - fake.started
+    await bot.message_store.flush()
+    bot.message_store.close()
+    bot.retry_queue.close()
+
+    latency = bot.latency_percentiles(
+        histogram for series in bot.pair_series.values() for histogram in series.latency
+    ) or [float('nan')] * 3
+    span = records[-1]['t'] - first
+    print(f"Records: {len(records)} spanning {span:.1f}s (recorded rate {len(records) / span if span else 0:.1f}/s)")
+    print(f"Fed in {fed:.2f}s, drained in {seconds:.2f}s: {len(records) / seconds:.1f} updates/s overall")
+    print(f"Max behind schedule: {behind:.2f}s | Backpressured: {bot.dispatch_stats['backpressured']}")
+    print(
+        f"Forwarded: {pair_total('forwarded')} (Fast: {pair_total('fast_path')}) | Edited: {pair_total('edited')}"
+        f" | Deleted: {pair_total('deleted')} | Blocked: {pair_total('blocked')} | Queued: {pair_total('queued')}"
+    )
+    print(f"Latency p50/p95/p99: {latency[0] * 1000:.0f} / {latency[1] * 1000:.0f} / {latency[2] * 1000:.0f} ms")
+    print(f"FloodWaits: {fake.flood_waits} | Disconnects: {fake.disconnects} | API calls: {fake.calls}")
+
+
+if __name__ == "__main__":
+    asyncio.run(replay())
@@ -1,27 +1,118 @@
 import asyncio
 import logging
 import json
-from telethon import TelegramClient, events, errors
+import re
+import sqlite3
+import threading
+import time
+import os
+import random
+import bisect
+import copy
+import hashlib
+import itertools
+from telethon import TelegramClient, events, errors, utils
+from telethon.tl import types as tl_types
 from telethon.tl.types import MessageMediaWebPage, MessageEntityTextUrl, MessageEntityUrl, MessageMediaPhoto, MessageMediaDocument
-from collections import deque
-from datetime import datetime
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from types import SimpleNamespace
 import emoji
 
-API_ID = 23617139  # Your API ID
-API_HASH = "5bfc582b080fa09a1a2eaa6ee60fd5d4"  # Your API hash
-SESSION_FILE = "userbot_session"
-client = TelegramClient(SESSION_FILE, API_ID, API_HASH)
+API_ID = int(os.environ.get("FORWARDBOT_API_ID", 23617139))  # Your API ID
+API_HASH = os.environ.get("FORWARDBOT_API_HASH", "5bfc582b080fa09a1a2eaa6ee60fd5d4")  # Your API hash
+SESSION_FILE = os.environ.get("FORWARDBOT_SESSION", "userbot_session")  # Empty keeps the session in memory
+client = TelegramClient(SESSION_FILE or None, API_ID, API_HASH)
+SHARD_SESSIONS = []  # Extra account session files; pairs are spread over these and the main account
+SHARD_VIRTUAL_NODES = 64  # Points per account on the consistent-hash ring
+shard_clients = {name: TelegramClient(name, API_ID, API_HASH) for name in SHARD_SESSIONS}  # 'main' is `client`
 
 # Configuration
 MAPPINGS_FILE = "channel_mappings.json"
+MAPPINGS_BACKEND = "json"  # "json" rewrites MAPPINGS_FILE atomically; "sqlite" keeps one row per pair in MESSAGE_DB_FILE
+MAPPINGS_SAVE_DELAY = 2  # seconds; changes inside this window are written together
+CONFIG_FILE = "forwardbot_config.json"  # JSON overrides for RELOADABLE_SETTINGS, applied live when it changes
+CONFIG_POLL_INTERVAL = 5  # seconds between checks of CONFIG_FILE and MAPPINGS_FILE for outside edits
 MAX_RETRIES = 3
 RETRY_DELAY = 5  # seconds
-MAX_QUEUE_SIZE = 100
-MAX_MAPPING_HISTORY = 1000
+MAX_QUEUE_SIZE = 100  # Retry queue items loaded per drain pass; the rest wait on disk
+RETRY_QUEUE_WORKERS = 4  # Destinations drained in parallel
+RETRY_QUEUE_MAX_ATTEMPTS = 10
+RETRY_BACKOFF_MAX = 900  # seconds; backoff starts at RETRY_DELAY and doubles per attempt
+RETRY_QUEUE_POLL_INTERVAL = 5  # seconds
+MAX_MAPPING_HISTORY = 10000  # Message ID mappings kept in the in-memory LRU
+MESSAGE_DB_FILE = "forwarded_messages.db"
+MAPPING_FLUSH_INTERVAL = 1  # seconds between batched writes to MESSAGE_DB_FILE
+MAPPING_RETENTION_DAYS = 30
+MAPPING_MAX_ROWS_PER_PAIR = 500000
+MAPPING_PRUNE_INTERVAL = 3600  # seconds
+REPLY_INDEX_SIZE = 50000  # Recent messages fingerprinted for reply threading
+MEDIA_CACHE_SIZE = 5000  # Resolved photo/document references reused across destinations
+PEER_RESOLVE_CONCURRENCY = 10  # Chats resolved in parallel at startup and on /setpair
+DEDUP_WINDOW = 3600  # seconds a destination remembers content from pairs with dedup enabled
+DEDUP_MAX_ENTRIES = 100000  # Fingerprints remembered across all destinations
+DESTINATION_RATE_LIMIT = 1  # Outgoing requests/sec per destination chat
+DESTINATION_BURST = 5
+GLOBAL_RATE_LIMIT = 25  # Outgoing requests/sec for the whole account
+GLOBAL_BURST = 30
+MAX_FLOOD_WAIT = 10  # seconds; a destination parked longer than this fails its calls so they go to the retry queue
+SOURCE_QUEUE_HIGH_WATER = 1000  # Events buffered per source before handlers wait (backpressure)
+SOURCE_WORKER_IDLE_TIMEOUT = 300  # seconds an idle source worker lingers before exiting
+FORWARD_BATCH_SIZE = 100  # Telegram's limit on message IDs per forward request
+ALBUM_BUFFER_SECONDS = 0.7  # How long a source worker waits for the next part of an album
+EDIT_COALESCE_SECONDS = 3  # Edits to one message within this window collapse into the latest
+MAX_DELETE_BATCH = 100  # Telegram's limit on message IDs per delete request
+STATS_FILE = "pair_stats.json"
+STATS_WINDOW_MINUTES = 60  # Per-minute history kept for each pair
+STATS_RATE_MINUTES = 5  # Window the msgs/min figure is averaged over
+STATS_SNAPSHOT_INTERVAL = 60  # seconds between snapshots of pair_stats to STATS_FILE
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464  # Prometheus scrape endpoint at /metrics; None disables it
+LOOP_LAG_INTERVAL = 1  # seconds between event-loop lag probes
+RECORD_FILE = None  # Append routed updates here as JSON lines for benchmarks/replay.py; None disables
+RECORD_FLUSH_INTERVAL = 1  # seconds between writes to RECORD_FILE
+BACKFILL_PAGE_SIZE = 100  # Messages per history request when catching up after downtime
+BACKFILL_REQUEST_RATE = 2  # History requests/sec across all sources
+BACKFILL_CONCURRENCY = 3  # Sources caught up in parallel
+BACKFILL_MAX_MESSAGES = 50000  # Per source per catch-up; past this the oldest missed messages are skipped with a notice
+BACKFILL_MAX_FLOOD_WAIT = 300  # seconds; a longer FloodWait on a history read abandons that catch-up
 MONITOR_CHAT_ID = None
 NOTIFY_CHAT_ID = None  # Set this to the chat ID for notifications
 INACTIVITY_THRESHOLD = 3600  # Notify if no activity for 1 hour (in seconds)
 MAX_MESSAGE_LENGTH = 4096  # Telegram's max message length
+MAX_FANOUT_CONCURRENCY = 10  # Max outgoing requests in flight at once
+PHRASE_AUTOMATON_THRESHOLD = 200  # Blacklist + blocked sentences count above which Aho-Corasick is used
+FILTER_WORKERS = 0  # Processes running the filter pipeline off the event loop; 0 filters in-process
+FILTER_WORKER_PLAN_CACHE = 1000  # Compiled pair plans each filter process keeps
+
+# Settings CONFIG_FILE may change at runtime: name -> (type, minimum). Anything
+# else (sessions, file paths, the metrics port) needs a restart.
+RELOADABLE_SETTINGS = {
+    'MAX_RETRIES': (int, 1),
+    'RETRY_DELAY': (float, 0),
+    'MAX_QUEUE_SIZE': (int, 1),
+    'RETRY_QUEUE_MAX_ATTEMPTS': (int, 1),
+    'RETRY_BACKOFF_MAX': (float, 0),
+    'RETRY_QUEUE_POLL_INTERVAL': (float, 0.1),
+    'MAX_MAPPING_HISTORY': (int, 1),
+    'DEDUP_WINDOW': (float, 0),
+    'DEDUP_MAX_ENTRIES': (int, 1),
+    'DESTINATION_RATE_LIMIT': (float, 0.01),
+    'DESTINATION_BURST': (float, 1),
+    'GLOBAL_RATE_LIMIT': (float, 0.01),
+    'GLOBAL_BURST': (float, 1),
+    'MAX_FLOOD_WAIT': (float, 0),
+    'SOURCE_WORKER_IDLE_TIMEOUT': (float, 1),
+    'ALBUM_BUFFER_SECONDS': (float, 0),
+    'EDIT_COALESCE_SECONDS': (float, 0),
+    'MAX_FANOUT_CONCURRENCY': (int, 1),
+    'PHRASE_AUTOMATON_THRESHOLD': (int, 0),
+    'BACKFILL_REQUEST_RATE': (float, 0.01),
+    'BACKFILL_MAX_MESSAGES': (int, 0),
+    'INACTIVITY_THRESHOLD': (float, 60),
+}
+DEFAULT_SETTINGS = {name: globals()[name] for name in RELOADABLE_SETTINGS}  # What a key removed from CONFIG_FILE reverts to
 
 # Logging setup
 logging.basicConfig(
@@ -31,42 +122,1254 @@ logging.basicConfig(
 )
 logger = logging.getLogger("ForwardBot")
 
+# Precompiled patterns
+URL_PATTERN = re.compile(r'https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+(?:/[^\s]*)?')
+MENTION_PATTERN = re.compile(r'@[a-zA-Z0-9_]+|\[([^\]]+)\]\(tg://user\?id=\d+\)')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
 # Data structures
 channel_mappings = {}
-message_queue = deque(maxlen=MAX_QUEUE_SIZE)
 is_connected = False
 pair_stats = {}
+pair_series = {}  # (user_id, pair_name) -> PairSeries with per-minute counts and send latency
+pair_json_cache = {}  # (user_id, pair_name) -> serialized mapping, so saves only re-encode changed pairs
+dirty_mappings = set()  # (user_id, pair_name); pair_name None means the whole user, user_id None everything
+mapping_save_task = None
+mapping_save_lock = threading.Lock()
+mapping_save_stats = {'saves': 0, 'seconds': 0.0, 'last_seconds': 0.0, 'bytes': 0, 'last_bytes': 0}
+source_routes = {}  # int source chat ID -> [(user_id, pair_name, mapping), ...] for active pairs
+shard_routes = {}  # shard name -> {source chat ID -> routes}, the part of source_routes that account handles
+destination_shards = {}  # int destination chat ID -> name of the account that sends to it
+shard_ring = []  # sorted (point, shard name), see rebuild_shard_ring()
+filter_plans = {}  # (user_id, pair_name) -> compiled filter plan, see compile_filter_plan()
+filter_pool = None  # ProcessPoolExecutor when FILTER_WORKERS > 0
+filter_pool_stats = {'batches': 0, 'messages': 0, 'errors': 0}
+prefiltered = {}  # (user_id, pair_name, id(message)) -> apply_filter_plan() result computed by the filter pool
+worker_plans = {}  # Inside a filter process only: (user_id, pair_name) -> (plan version, compiled plan)
+filter_plan_versions = itertools.count(1)  # Tells a filter process whether its compiled copy of a plan is current
+fanout_semaphore = asyncio.Semaphore(MAX_FANOUT_CONCURRENCY)
+source_fingerprints = OrderedDict()  # (source, msg_id) -> content fingerprint of recently seen source messages
+reply_targets = OrderedDict()  # (destination, fingerprint) -> destination msg_id of recently sent messages
+reply_lookup_stats = {'mapped': 0, 'indexed': 0, 'rpc': 0, 'unresolved': 0}
+recent_content = OrderedDict()  # (destination, fingerprint) -> time last sent, oldest first
+media_cache = OrderedDict()  # ('photo' | 'document', id, access_hash, spoiler) -> input media
+media_cache_stats = {'hits': 0, 'misses': 0, 'refreshed': 0}
+forward_restricted = set()  # source chat IDs that refuse native forwards (protected content); copied instead
+peer_cache = {}  # (shard, int chat ID) -> InputPeer, persisted in MESSAGE_DB_FILE so access hashes survive restarts
+peer_errors = {}  # (shard, int chat ID) -> why it could not be resolved
+source_queues = {}  # source chat ID -> asyncio.Queue of (kind, event, routes)
+source_workers = {}  # source chat ID -> worker task
+pair_queues = {}  # (user_id, pair_name) -> asyncio.Queue of (kind, payload, mapping) for that pair
+pair_workers = {}  # (user_id, pair_name) -> worker task
+pending_edits = {}  # message mapping key -> {'event': latest edit event, 'absorbed': superseded edits}
+edit_timers = set()  # running coalesce_edit_later() tasks, referenced so they are not collected mid-sleep
+delete_timers = set()  # running delete_later() tasks for deletions deferred by a FloodWait
+dispatch_stats = {
+    'dispatched': 0, 'backpressured': 0, 'handler_seconds': 0.0, 'handler_max': 0.0,
+    'processed': 0, 'process_seconds': 0.0, 'process_max': 0.0
+}
+loop_lag = {'last': 0.0, 'max': 0.0}
+metrics_server = None
+watched_mtimes = {}  # path -> mtime_ns last loaded or written by the bot itself
+
+class LatencyHistogram:
+    """Cumulative-bucket histogram in the Prometheus exposition layout."""
+
+    def __init__(self, bounds=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        for i, bound in enumerate(self.bounds):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+
+handler_latency = LatencyHistogram()
+process_latency = LatencyHistogram()
+
+class MessageMappingStore:
+    """Source -> destination message IDs in SQLite (WAL), with an LRU cache in front.
+
+    Keys are (source, destination, source_msg_id). Writes are buffered and
+    committed in batches from a worker thread by flush(). The same batches
+    carry each pair's high-water mark: the last source message ID it handled.
+    """
+
+    def __init__(self, path, cache_size):
+        self.path = path
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.pending = {}  # key -> (dest_msg_id, created), or None for a delete
+        self.inflight = {}
+        self.high_water = {}  # (user_id, pair_name) -> (source, last msg_id handled from that source)
+        self.pending_marks = {}  # (user_id, pair_name) -> (source, msg_id), or None to forget the pair
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS message_map ("
+            "source INTEGER NOT NULL, destination INTEGER NOT NULL, source_msg_id INTEGER NOT NULL, "
+            "dest_msg_id INTEGER NOT NULL, created REAL NOT NULL, "
+            "PRIMARY KEY (source, destination, source_msg_id)) WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS message_map_created ON message_map (source, destination, created)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pair_high_water ("
+            "user_id TEXT NOT NULL, pair_name TEXT NOT NULL, last_msg_id INTEGER NOT NULL, source INTEGER, "
+            "PRIMARY KEY (user_id, pair_name))"
+        )
+        if 'source' not in [row[1] for row in self.conn.execute("PRAGMA table_info(pair_high_water)")]:
+            # Marks written before the source was recorded cannot be trusted and are ignored
+            self.conn.execute("ALTER TABLE pair_high_water ADD COLUMN source INTEGER")
+        self.conn.commit()
+        self.high_water = {
+            (user_id, pair_name): (source, last_msg_id)
+            for user_id, pair_name, source, last_msg_id in self.conn.execute(
+                "SELECT user_id, pair_name, source, last_msg_id FROM pair_high_water WHERE source IS NOT NULL"
+            )
+        }
+        logger.info(f"Message mapping store opened at {self.path}")
+
+    def _remember(self, key, dest_msg_id):
+        self.cache[key] = dest_msg_id
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def resize(self, cache_size):
+        self.cache_size = cache_size
+        while len(self.cache) > cache_size:
+            self.cache.popitem(last=False)
+
+    def put(self, key, dest_msg_id):
+        self._remember(key, dest_msg_id)
+        self.pending[key] = (dest_msg_id, time.time())
+
+    def delete(self, key):
+        self.cache.pop(key, None)
+        self.pending[key] = None
+
+    def last_handled(self, user_id, pair_name, source):
+        """The pair's high-water mark, or None if it has none for this source (e.g. it was repointed)."""
+        mark = self.high_water.get((user_id, pair_name))
+        return mark[1] if mark is not None and mark[0] == source else None
+
+    def mark(self, user_id, pair_name, source, msg_id):
+        key = (user_id, pair_name)
+        if msg_id > (self.last_handled(user_id, pair_name, source) or 0):
+            self.high_water[key] = self.pending_marks[key] = (source, msg_id)
+
+    def forget_mark(self, user_id, pair_name):
+        self.high_water.pop((user_id, pair_name), None)
+        self.pending_marks[(user_id, pair_name)] = None
+
+    def _lookup_memory(self, key):
+        # Returns (known, dest_msg_id); known is False when only the database can answer
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return True, self.cache[key]
+        for buffered in (self.pending, self.inflight):
+            if key in buffered:
+                return True, buffered[key][0] if buffered[key] else None
+        return False, None
+
+    async def get(self, key):
+        known, dest_msg_id = self._lookup_memory(key)
+        if known or self.conn is None:
+            return dest_msg_id
+        dest_msg_id = await asyncio.to_thread(self._select, key)
+        if dest_msg_id is not None:
+            self._remember(key, dest_msg_id)
+        return dest_msg_id
+
+    async def get_many(self, keys):
+        """Resolve many keys with at most one database round trip; unknown keys are omitted."""
+        found = {}
+        missing = []
+        for key in keys:
+            known, dest_msg_id = self._lookup_memory(key)
+            if not known:
+                missing.append(key)
+            elif dest_msg_id is not None:
+                found[key] = dest_msg_id
+        if missing and self.conn is not None:
+            found.update(await asyncio.to_thread(self._select_many, missing))
+        return found
+
+    def _select(self, key):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT dest_msg_id FROM message_map WHERE source = ? AND destination = ? AND source_msg_id = ?", key
+            ).fetchone()
+        return row[0] if row else None
+
+    def _select_many(self, keys):
+        by_pair = {}
+        for source, destination, source_msg_id in keys:
+            by_pair.setdefault((source, destination), []).append(source_msg_id)
+        found = {}
+        with self.lock:
+            for (source, destination), msg_ids in by_pair.items():
+                for i in range(0, len(msg_ids), 500):
+                    chunk = msg_ids[i:i + 500]
+                    rows = self.conn.execute(
+                        "SELECT source_msg_id, dest_msg_id FROM message_map WHERE source = ? AND destination = ? "
+                        f"AND source_msg_id IN ({', '.join('?' * len(chunk))})",
+                        (source, destination, *chunk)
+                    ).fetchall()
+                    found.update(((source, destination, source_msg_id), dest_msg_id) for source_msg_id, dest_msg_id in rows)
+        return found
+
+    async def flush(self):
+        if not (self.pending or self.pending_marks) or self.conn is None:
+            return
+        self.inflight, self.pending = self.pending, {}
+        marks, self.pending_marks = self.pending_marks, {}
+        try:
+            await asyncio.to_thread(self._write_batch, self.inflight, marks)
+        except Exception as e:
+            logger.error(f"Error writing message mappings: {e}")
+            # Keep the batch; anything newer in pending wins
+            self.pending = {**self.inflight, **self.pending}
+            self.pending_marks = {**marks, **self.pending_marks}
+        finally:
+            self.inflight = {}
+
+    def _write_batch(self, batch, marks=None):
+        upserts = [(*key, entry[0], entry[1]) for key, entry in batch.items() if entry]
+        deletes = [key for key, entry in batch.items() if not entry]
+        marks = marks or {}
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO message_map VALUES (?, ?, ?, ?, ?)", upserts)
+            self.conn.executemany(
+                "DELETE FROM message_map WHERE source = ? AND destination = ? AND source_msg_id = ?", deletes
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO pair_high_water (user_id, pair_name, source, last_msg_id) VALUES (?, ?, ?, ?)",
+                [(*key, *mark) for key, mark in marks.items() if mark is not None]
+            )
+            self.conn.executemany(
+                "DELETE FROM pair_high_water WHERE user_id = ? AND pair_name = ?",
+                [key for key, mark in marks.items() if mark is None]
+            )
+            self.conn.commit()
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM message_map").fetchone()[0]
+
+    def prune(self, max_age, max_rows_per_pair):
+        removed = 0
+        with self.lock:
+            removed += self.conn.execute(
+                "DELETE FROM message_map WHERE created < ?", (time.time() - max_age,)
+            ).rowcount
+            pairs = self.conn.execute(
+                "SELECT source, destination FROM message_map GROUP BY source, destination HAVING COUNT(*) > ?",
+                (max_rows_per_pair,)
+            ).fetchall()
+            for source, destination in pairs:
+                removed += self.conn.execute(
+                    "DELETE FROM message_map WHERE source = ? AND destination = ? AND created < ("
+                    "SELECT created FROM message_map WHERE source = ? AND destination = ? "
+                    "ORDER BY created DESC LIMIT 1 OFFSET ?)",
+                    (source, destination, source, destination, max_rows_per_pair - 1)
+                ).rowcount
+            self.conn.commit()
+        return removed
+
+    def close(self):
+        if self.conn is None:
+            return
+        self._write_batch(self.pending, self.pending_marks)
+        self.pending = {}
+        self.pending_marks = {}
+        self.conn.close()
+        self.conn = None
+
+message_store = MessageMappingStore(MESSAGE_DB_FILE, MAX_MAPPING_HISTORY)
+
+class RetryQueue:
+    """Failed forwards persisted in SQLite so nothing is dropped during outages or restarts.
+
+    Only what is needed to refetch and resend is stored: the source message
+    reference and the pair it was bound for.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.lock = threading.Lock()
+        self.depth = 0
+        self.oldest = None  # enqueue time of the oldest item
+
+    def open(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS retry_queue ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, source INTEGER NOT NULL, source_msg_id INTEGER NOT NULL, "
+            "destination INTEGER NOT NULL, user_id TEXT NOT NULL, pair_name TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL, enqueued REAL NOT NULL, next_attempt REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS retry_queue_destination ON retry_queue (destination, id)")
+        self.conn.commit()
+        self._refresh_stats()
+        if self.depth:
+            logger.info(f"Retry queue restored with {self.depth} pending message(s)")
+
+    def _execute(self, sql, params=()):
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+            self.conn.commit()
+        return rows
+
+    def _refresh_stats(self):
+        self.depth, self.oldest = self._execute("SELECT COUNT(*), MIN(enqueued) FROM retry_queue")[0]
+
+    async def push(self, source, source_msg_id, destination, user_id, pair_name):
+        now = time.time()
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO retry_queue (source, source_msg_id, destination, user_id, pair_name, attempts, enqueued, next_attempt) "
+            "VALUES (?, ?, ?, ?, ?, 0, ?, ?)",
+            (source, source_msg_id, destination, user_id, pair_name, now, now)
+        )
+        self.depth += 1
+        if self.oldest is None:
+            self.oldest = now
+
+    async def due_by_destination(self, limit):
+        """Due items grouped by destination, oldest first.
+
+        An item is skipped while an earlier item for the same destination is
+        still backing off, so nothing overtakes an earlier message to a chat.
+        """
+        now = time.time()
+        rows = await asyncio.to_thread(
+            self._execute,
+            "SELECT id, source, source_msg_id, destination, user_id, pair_name, attempts FROM retry_queue q "
+            "WHERE next_attempt <= ? AND NOT EXISTS ("
+            "SELECT 1 FROM retry_queue b WHERE b.destination = q.destination AND b.id < q.id AND b.next_attempt > ?) "
+            "ORDER BY id LIMIT ?",
+            (now, now, limit)
+        )
+        groups = {}
+        for row in rows:
+            groups.setdefault(row[3], []).append(row)
+        return groups
+
+    async def remove(self, item_id):
+        await asyncio.to_thread(self._execute, "DELETE FROM retry_queue WHERE id = ?", (item_id,))
+
+    async def defer(self, item_id, seconds):
+        """Push an item back without counting an attempt."""
+        await asyncio.to_thread(
+            self._execute, "UPDATE retry_queue SET next_attempt = ? WHERE id = ?", (time.time() + seconds, item_id)
+        )
+
+    async def reschedule(self, item_id, attempts):
+        delay = min(RETRY_BACKOFF_MAX, RETRY_DELAY * 2 ** attempts) * random.uniform(0.5, 1.5)
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE retry_queue SET attempts = ?, next_attempt = ? WHERE id = ?",
+            (attempts, time.time() + delay, item_id)
+        )
+
+    async def refresh_stats(self):
+        await asyncio.to_thread(self._refresh_stats)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+retry_queue = RetryQueue(MESSAGE_DB_FILE)
+retry_drain_lock = asyncio.Lock()
+backfill_holds = {}  # source chat ID -> live events held back while that source catches up
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        """Take a token, returning how long the caller must wait before using it."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class SendScheduler:
+    """Paces every outgoing send/edit/delete per destination and per account.
+
+    Calls to one destination run one at a time in arrival order, through the
+    account (shard) that destination is assigned to. A FloodWait parks only the
+    destination that raised it; other destinations keep flowing. While a
+    destination is parked for more than MAX_FLOOD_WAIT its calls raise
+    FloodWaitError at once, so callers queue the work instead of sleeping on it.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.locks = {}
+        self.global_buckets = {}  # shard name -> account-wide TokenBucket
+        self.parked_until = {}
+        self.stats = {}  # destination -> {'sent', 'flood_waits', 'parked_seconds'}
+
+    def destination_stats(self, destination):
+        if destination not in self.stats:
+            self.stats[destination] = {'sent': 0, 'flood_waits': 0, 'parked_seconds': 0}
+        return self.stats[destination]
+
+    def park(self, destination, seconds):
+        self.parked_until[destination] = max(self.parked_until.get(destination, 0), time.monotonic() + seconds)
+        stats = self.destination_stats(destination)
+        stats['flood_waits'] += 1
+        stats['parked_seconds'] += seconds
+        logger.warning(f"Flood wait for {destination}: parked for {seconds} seconds")
+
+    def parked_for(self, destination):
+        return max(0, self.parked_until.get(destination, 0) - time.monotonic())
+
+    def retune(self):
+        """Apply changed rate limits to existing buckets, keeping their tokens within the new burst."""
+        for buckets, rate, burst in (
+            (self.buckets.values(), DESTINATION_RATE_LIMIT, DESTINATION_BURST),
+            (self.global_buckets.values(), GLOBAL_RATE_LIMIT, GLOBAL_BURST),
+        ):
+            for bucket in buckets:
+                bucket.rate = rate
+                bucket.capacity = burst
+                bucket.tokens = min(bucket.tokens, burst)
+
+    async def _wait_turn(self, destination):
+        while True:
+            parked = self.parked_for(destination)
+            if parked <= 0:
+                break
+            if parked > MAX_FLOOD_WAIT:
+                raise errors.FloodWaitError(request=None, capture=int(parked) + 1)
+            await asyncio.sleep(parked)
+        if destination not in self.buckets:
+            self.buckets[destination] = TokenBucket(DESTINATION_RATE_LIMIT, DESTINATION_BURST)
+        delay = self.buckets[destination].reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        shard = destination_shards.get(destination, 'main')
+        if shard not in self.global_buckets:
+            self.global_buckets[shard] = TokenBucket(GLOBAL_RATE_LIMIT, GLOBAL_BURST)
+        delay = self.global_buckets[shard].reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def call(self, destination, method, *args, **kwargs):
+        if destination not in self.locks:
+            self.locks[destination] = asyncio.Lock()
+        async with self.locks[destination]:
+            while True:
+                await self._wait_turn(destination)
+                try:
+                    # Only the request itself takes a fanout slot, never the pacing sleeps
+                    async with fanout_semaphore:
+                        result = await method(*args, **kwargs)
+                except errors.FloodWaitError as e:
+                    self.park(destination, e.seconds)
+                    if e.seconds > MAX_FLOOD_WAIT:
+                        raise
+                    continue
+                self.destination_stats(destination)['sent'] += 1
+                return result
+
+    async def call_client(self, entity, name, *args, **kwargs):
+        shard = destination_shards.get(entity, 'main')
+        method = getattr(shard_client(shard), name)
+        return await self.call(entity, method, input_peer(entity, shard), *args, **kwargs)
+
+    async def send_message(self, entity, *args, **kwargs):
+        return await self.call_client(entity, 'send_message', *args, **kwargs)
+
+    async def edit_message(self, entity, *args, **kwargs):
+        return await self.call_client(entity, 'edit_message', *args, **kwargs)
+
+    async def delete_messages(self, entity, *args, **kwargs):
+        return await self.call_client(entity, 'delete_messages', *args, **kwargs)
+
+    async def forward_messages(self, entity, *args, **kwargs):
+        return await self.call_client(entity, 'forward_messages', *args, **kwargs)
+
+    async def send_file(self, entity, *args, **kwargs):
+        return await self.call_client(entity, 'send_file', *args, **kwargs)
+
+send_scheduler = SendScheduler()
+
+# Geometric latency buckets (upper bounds in seconds), 50ms up to roughly 45 minutes
+LATENCY_BUCKETS = [0.05 * 1.25 ** i for i in range(62)]
+SERIES_KINDS = ('forwarded', 'edited', 'deleted', 'blocked', 'queued')
+
+def latency_percentiles(histograms, quantiles=(0.5, 0.95, 0.99)):
+    """Percentiles (bucket upper bounds, seconds) of merged latency histograms, or None when empty."""
+    merged = {}
+    for histogram in histograms:
+        for bucket, count in histogram.items():
+            merged[bucket] = merged.get(bucket, 0) + count
+    total = sum(merged.values())
+    if not total:
+        return None
+    results = []
+    for q in quantiles:
+        target = q * total
+        seen = 0
+        for bucket in sorted(merged):
+            seen += merged[bucket]
+            if seen >= target:
+                results.append(LATENCY_BUCKETS[bucket])
+                break
+    return results
+
+class PairSeries:
+    """Per-minute ring buffer of event counts and latency histograms for one pair."""
+
+    def __init__(self, window=STATS_WINDOW_MINUTES):
+        self.window = window
+        self.minutes = [None] * window
+        self.counts = {kind: [0] * window for kind in SERIES_KINDS}
+        self.latency = [{} for _ in range(window)]  # bucket index -> count
+
+    def _slot(self, now):
+        minute = int(now // 60)
+        slot = minute % self.window
+        if self.minutes[slot] != minute:
+            self.minutes[slot] = minute
+            for counts in self.counts.values():
+                counts[slot] = 0
+            self.latency[slot] = {}
+        return slot
+
+    def _recent_slots(self, minutes, now):
+        current = int(now // 60)
+        return [i for i, minute in enumerate(self.minutes) if minute is not None and current - minutes < minute <= current]
+
+    def add(self, kind, count=1, now=None):
+        self.counts[kind][self._slot(time.time() if now is None else now)] += count
+
+    def add_latency(self, seconds, now=None):
+        histogram = self.latency[self._slot(time.time() if now is None else now)]
+        bucket = min(bisect.bisect_left(LATENCY_BUCKETS, seconds), len(LATENCY_BUCKETS) - 1)
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+
+    def rate(self, kind, minutes=STATS_RATE_MINUTES, now=None):
+        """Average events per minute over the last `minutes` minutes."""
+        slots = self._recent_slots(minutes, time.time() if now is None else now)
+        return sum(self.counts[kind][i] for i in slots) / minutes
+
+    def percentiles(self, quantiles=(0.5, 0.95, 0.99), now=None):
+        """Latency percentiles over the whole window, or None."""
+        slots = self._recent_slots(self.window, time.time() if now is None else now)
+        return latency_percentiles([self.latency[i] for i in slots], quantiles)
+
+    def to_dict(self):
+        return {
+            'minutes': list(self.minutes),
+            'counts': {kind: list(counts) for kind, counts in self.counts.items()},
+            'latency': [{str(bucket): count for bucket, count in histogram.items()} for histogram in self.latency]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        series = cls()
+        if len(data.get('minutes', [])) != series.window:
+            return series  # Window size changed since the snapshot; start over
+        series.minutes = list(data['minutes'])
+        for kind, counts in data.get('counts', {}).items():
+            if kind in series.counts:
+                series.counts[kind] = list(counts)
+        series.latency = [{int(bucket): count for bucket, count in histogram.items()} for histogram in data['latency']]
+        return series
+
+def new_pair_stats():
+    return {
+        'forwarded': 0, 'edited': 0, 'deleted': 0, 'blocked': 0, 'queued': 0, 'fast_path': 0,
+        'edits_coalesced': 0, 'deduplicated': 0, 'last_activity': None
+    }
+
+def reset_pair_stats(user_id, pair_name):
+    pair_stats.setdefault(user_id, {})[pair_name] = new_pair_stats()
+    pair_series[(user_id, pair_name)] = PairSeries()
+
+def record_pair_event(user_id, pair_name, kind, count=1):
+    """Add to a pair's lifetime counter and, for the main kinds, its per-minute series."""
+    if not count:
+        return
+    pair_stats[user_id][pair_name][kind] += count
+    if kind in SERIES_KINDS:
+        key = (user_id, pair_name)
+        if key not in pair_series:
+            pair_series[key] = PairSeries()
+        pair_series[key].add(kind, count)
+
+def record_send_latency(user_id, pair_name, message):
+    # Source message date to the moment its copy was sent
+    date = getattr(message, 'date', None)
+    if date is None:
+        return
+    key = (user_id, pair_name)
+    if key not in pair_series:
+        pair_series[key] = PairSeries()
+    pair_series[key].add_latency(max(time.time() - date.timestamp(), 0))
+
+def format_pair_series(user_id, pair_name):
+    series = pair_series.get((user_id, pair_name))
+    if series is None:
+        return "0.0 msg/min | Latency: N/A"
+    rate = series.rate('forwarded')
+    latency = series.percentiles()
+    if latency is None:
+        return f"{rate:.1f} msg/min | Latency: N/A"
+    p50, p95, p99 = latency
+    return f"{rate:.1f} msg/min | Latency p50/p95/p99: {p50:.1f}s / {p95:.1f}s / {p99:.1f}s"
+
+def collect_stats_snapshot():
+    return {
+        'saved_at': time.time(),
+        'pairs': {
+            user_id: {
+                pair_name: {
+                    'totals': dict(stats),
+                    'series': pair_series[(user_id, pair_name)].to_dict() if (user_id, pair_name) in pair_series else None
+                }
+                for pair_name, stats in pairs.items()
+            }
+            for user_id, pairs in pair_stats.items()
+        }
+    }
 
-def save_mappings():
+def write_stats_snapshot(snapshot):
+    tmp_file = f"{STATS_FILE}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(snapshot, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, STATS_FILE)
+
+def load_stats_snapshot():
+    try:
+        with open(STATS_FILE, "r") as f:
+            return json.load(f).get('pairs', {})
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error(f"Error loading stats snapshot: {e}")
+        return {}
+
+def save_mappings(user_id=None, pair_name=None):
+    """Schedule a background save of the changed pair (or user, or everything)."""
+    global mapping_save_task
+    dirty_mappings.add((user_id, pair_name))
+    if mapping_save_task is not None and not mapping_save_task.done():
+        return
     try:
-        with open(MAPPINGS_FILE, "w") as f:
-            json.dump(channel_mappings, f)
+        mapping_save_task = asyncio.get_running_loop().create_task(persist_mappings_later())
+    except RuntimeError:
+        flush_mappings()
+
+def collect_mapping_changes():
+    # Runs on the event loop so the thread that writes never sees a half-updated mapping
+    dirty = set(dirty_mappings)
+    dirty_mappings.clear()
+    keys = set()
+    for user_id, pair_name in dirty:
+        if user_id is None:
+            keys.update((u, p) for u, pairs in channel_mappings.items() for p in pairs)
+            keys.update(pair_json_cache)
+        elif pair_name is None:
+            keys.update((user_id, p) for p in channel_mappings.get(user_id, {}))
+            keys.update(k for k in pair_json_cache if k[0] == user_id)
+        else:
+            keys.add((user_id, pair_name))
+
+    upserts = {}
+    deletes = []
+    for user_id, pair_name in keys:
+        mapping = channel_mappings.get(user_id, {}).get(pair_name)
+        if mapping is None:
+            pair_json_cache.pop((user_id, pair_name), None)
+            deletes.append((user_id, pair_name))
+        else:
+            upserts[(user_id, pair_name)] = pair_json_cache[(user_id, pair_name)] = json.dumps(mapping)
+    if MAPPINGS_BACKEND == "sqlite":
+        return upserts, deletes, None, None
+    return upserts, deletes, list(channel_mappings), dict(pair_json_cache)
+
+def write_mappings(upserts, deletes, users, cache):
+    """Write collected changes; returns the number of bytes written."""
+    with mapping_save_lock:
+        if MAPPINGS_BACKEND == "sqlite":
+            conn = sqlite3.connect(MESSAGE_DB_FILE)
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO channel_pairs (user_id, pair_name, config) VALUES (?, ?, ?)",
+                    [(*key, config) for key, config in upserts.items()]
+                )
+                conn.executemany("DELETE FROM channel_pairs WHERE user_id = ? AND pair_name = ?", deletes)
+                conn.commit()
+            finally:
+                conn.close()
+            return sum(len(config) for config in upserts.values())
+
+        # Reassemble the file from cached per-pair JSON, then swap it in atomically
+        by_user = {user_id: [] for user_id in users}
+        for (user_id, pair_name), config in cache.items():
+            by_user.setdefault(user_id, []).append(f"{json.dumps(pair_name)}: {config}")
+        content = "{" + ", ".join(
+            f"{json.dumps(user_id)}: {{{', '.join(pairs)}}}" for user_id, pairs in by_user.items()
+        ) + "}"
+        data = content.encode()
+        tmp_file = f"{MAPPINGS_FILE}.tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, MAPPINGS_FILE)
+        watched_mtimes[MAPPINGS_FILE] = file_mtime(MAPPINGS_FILE)  # Our own write is not an outside edit
+        return len(data)
+
+def record_mapping_save(seconds, written):
+    mapping_save_stats['saves'] += 1
+    mapping_save_stats['seconds'] += seconds
+    mapping_save_stats['last_seconds'] = seconds
+    mapping_save_stats['bytes'] += written
+    mapping_save_stats['last_bytes'] = written
+
+async def persist_mappings_later():
+    while dirty_mappings:
+        await asyncio.sleep(MAPPINGS_SAVE_DELAY)
+        changes = collect_mapping_changes()
+        start = time.perf_counter()
+        try:
+            written = await asyncio.to_thread(write_mappings, *changes)
+        except Exception as e:
+            logger.error(f"Error saving mappings: {e}")
+            dirty_mappings.add((None, None))
+            continue
+        record_mapping_save(time.perf_counter() - start, written)
+        logger.info(f"Channel mappings saved ({len(changes[0])} changed, {len(changes[1])} removed, {written} bytes).")
+
+def flush_mappings():
+    if not dirty_mappings:
+        return
+    try:
+        start = time.perf_counter()
+        changes = collect_mapping_changes()
+        written = write_mappings(*changes)
+        record_mapping_save(time.perf_counter() - start, written)
         logger.info("Channel mappings saved to file.")
     except Exception as e:
         logger.error(f"Error saving mappings: {e}")
 
+def shard_client(shard):
+    return client if shard == 'main' else shard_clients[shard]
+
+def shard_names():
+    return ['main', *shard_clients]
+
+def ring_point(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+def rebuild_shard_ring(names):
+    global shard_ring
+    shard_ring = sorted((ring_point(f"{name}#{i}"), name) for name in names for i in range(SHARD_VIRTUAL_NODES))
+
+def pair_shard(mapping):
+    """Account for a pair: its explicit 'shard' if that account is up, else the destination's place on the ring."""
+    live = {name for _, name in shard_ring}
+    shard = mapping.get('shard')
+    if shard in live:
+        return shard
+    if not shard_ring:
+        return 'main'
+    index = bisect.bisect(shard_ring, (ring_point(str(mapping.get('destination'))),)) % len(shard_ring)
+    return shard_ring[index][1]
+
+def mapping_shard(mapping):
+    try:
+        return destination_shards.get(int(mapping['destination'])) or pair_shard(mapping)
+    except (KeyError, TypeError, ValueError):
+        return pair_shard(mapping)
+
+def event_shard(event):
+    event_client = getattr(event, 'client', None)
+    for name, shard in shard_clients.items():
+        if shard is event_client:
+            return name
+    return 'main'
+
+def routes_for(event):
+    if not shard_clients:
+        return source_routes.get(event.chat_id)
+    # Every account in a source gets the update; each handles only its own pairs
+    return shard_routes.get(event_shard(event), {}).get(event.chat_id)
+
+def input_peer(chat_id, shard='main'):
+    """The pre-resolved peer for a chat, so Telethon skips its own lookup; the raw ID if unknown."""
+    return peer_cache.get((shard, chat_id), chat_id)
+
+def encode_peer(peer):
+    if isinstance(peer, tl_types.InputPeerChannel):
+        return 'channel', peer.channel_id, peer.access_hash
+    if isinstance(peer, tl_types.InputPeerUser):
+        return 'user', peer.user_id, peer.access_hash
+    if isinstance(peer, tl_types.InputPeerChat):
+        return 'chat', peer.chat_id, 0
+    if isinstance(peer, tl_types.InputPeerSelf):
+        return 'self', 0, 0
+    return None
+
+def decode_peer(kind, peer_id, access_hash):
+    if kind == 'channel':
+        return tl_types.InputPeerChannel(channel_id=peer_id, access_hash=access_hash)
+    if kind == 'user':
+        return tl_types.InputPeerUser(user_id=peer_id, access_hash=access_hash)
+    if kind == 'chat':
+        return tl_types.InputPeerChat(chat_id=peer_id)
+    return tl_types.InputPeerSelf()
+
+def open_peer_db():
+    # Access hashes are per account, hence the shard column
+    conn = sqlite3.connect(MESSAGE_DB_FILE)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS input_peers ("
+        "shard TEXT NOT NULL, chat_id INTEGER NOT NULL, kind TEXT NOT NULL, peer_id INTEGER NOT NULL, "
+        "access_hash INTEGER NOT NULL, PRIMARY KEY (shard, chat_id))"
+    )
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'peer_cache'").fetchone():
+        # Peers cached before sharding were all resolved by the main account
+        conn.execute(
+            "INSERT OR IGNORE INTO input_peers SELECT 'main', chat_id, kind, peer_id, access_hash FROM peer_cache"
+        )
+        conn.execute("DROP TABLE peer_cache")
+        conn.commit()
+    return conn
+
+def save_peers(rows):
+    conn = open_peer_db()
+    try:
+        conn.executemany("INSERT OR REPLACE INTO input_peers VALUES (?, ?, ?, ?, ?)", rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+def load_peer_cache():
+    try:
+        conn = open_peer_db()
+        try:
+            rows = conn.execute("SELECT shard, chat_id, kind, peer_id, access_hash FROM input_peers").fetchall()
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.error(f"Error loading peer cache: {e}")
+        return
+    for shard, chat_id, kind, peer_id, access_hash in rows:
+        peer_cache[(shard, chat_id)] = decode_peer(kind, peer_id, access_hash)
+    logger.info(f"Loaded {len(rows)} cached peers.")
+
+def pair_chat_ids(pairs):
+    """(shard, chat ID) for the source and destination of each pair, as the pair's account sees them."""
+    chat_ids = set()
+    for mapping in pairs:
+        shard = mapping_shard(mapping)
+        for field in ('source', 'destination'):
+            try:
+                chat_ids.add((shard, int(mapping[field])))
+            except (KeyError, TypeError, ValueError):
+                pass
+    return chat_ids
+
+async def resolve_peers(keys, force=False):
+    """Resolve (shard, chat ID) keys into input peers in parallel and persist them; returns failures."""
+    keys = [key for key in keys if force or key not in peer_cache]
+    semaphore = asyncio.Semaphore(PEER_RESOLVE_CONCURRENCY)
+    resolved = []
+
+    async def resolve(key):
+        shard, chat_id = key
+        async with semaphore:
+            try:
+                peer = await shard_client(shard).get_input_entity(chat_id)
+            except Exception as e:
+                peer_errors[key] = str(e) or type(e).__name__
+                return
+        peer_errors.pop(key, None)
+        peer_cache[key] = peer
+        row = encode_peer(peer)
+        if row is not None:
+            resolved.append((shard, chat_id, *row))
+
+    await asyncio.gather(*(resolve(key) for key in keys))
+    if resolved:
+        try:
+            await asyncio.to_thread(save_peers, resolved)
+        except Exception as e:
+            logger.error(f"Error saving peer cache: {e}")
+    failed = {key: peer_errors[key] for key in keys if key in peer_errors}
+    if keys:
+        logger.info(f"Resolved {len(keys) - len(failed)} of {len(keys)} peers")
+    for (shard, chat_id), error in failed.items():
+        logger.warning(f"Cannot resolve chat {chat_id} for account '{shard}': {error}")
+    return failed
+
+def rebuild_routing_index():
+    global source_routes, shard_routes, destination_shards
+    routes = {}
+    by_shard = {}
+    destinations = {}
+    for user_id, pairs in channel_mappings.items():
+        for pair_name, mapping in pairs.items():
+            # One account per destination keeps its sends in order and its pacing in one place
+            shard = pair_shard(mapping)
+            try:
+                shard = destinations.setdefault(int(mapping['destination']), shard)
+            except (KeyError, TypeError, ValueError):
+                pass
+            else:
+                if mapping.get('shard') not in (None, shard):
+                    logger.warning(f"Pair '{pair_name}' shares its destination with a pair on '{shard}', using that account")
+            if not mapping.get('active', False):
+                continue
+            try:
+                source_id = int(mapping['source'])
+            except (KeyError, TypeError, ValueError):
+                logger.warning(f"Pair '{pair_name}' skipped in routing index: invalid source '{mapping.get('source')}'")
+                continue
+            routes.setdefault(source_id, []).append((user_id, pair_name, mapping))
+            by_shard.setdefault(shard, {}).setdefault(source_id, []).append((user_id, pair_name, mapping))
+    source_routes = routes
+    shard_routes = by_shard
+    destination_shards = destinations
+    logger.info(f"Routing index rebuilt: {sum(len(v) for v in routes.values())} active pairs over {len(routes)} sources.")
+
+def load_mappings_from_db():
+    conn = sqlite3.connect(MESSAGE_DB_FILE)
+    try:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS channel_pairs ("
+            "user_id TEXT NOT NULL, pair_name TEXT NOT NULL, config TEXT NOT NULL, "
+            "PRIMARY KEY (user_id, pair_name))"
+        )
+        conn.commit()
+        rows = conn.execute("SELECT user_id, pair_name, config FROM channel_pairs").fetchall()
+    finally:
+        conn.close()
+    mappings = {}
+    for user_id, pair_name, config in rows:
+        mappings.setdefault(user_id, {})[pair_name] = json.loads(config)
+    return mappings
+
 def load_mappings():
     global channel_mappings
     try:
-        with open(MAPPINGS_FILE, "r") as f:
-            channel_mappings = json.load(f)
-        logger.info(f"Loaded {sum(len(v) for v in channel_mappings.values())} mappings from file.")
+        if MAPPINGS_BACKEND == "sqlite":
+            channel_mappings = load_mappings_from_db()
+        if not channel_mappings:
+            try:
+                watched_mtimes[MAPPINGS_FILE] = file_mtime(MAPPINGS_FILE)
+                with open(MAPPINGS_FILE, "r") as f:
+                    channel_mappings = json.load(f)
+                if MAPPINGS_BACKEND == "sqlite":
+                    logger.info("Importing mappings file into the database.")
+                    dirty_mappings.add((None, None))
+            except FileNotFoundError:
+                logger.info("No existing mappings file found. Starting fresh.")
+        logger.info(f"Loaded {sum(len(v) for v in channel_mappings.values())} mappings.")
+        snapshot = load_stats_snapshot()
         for user_id, pairs in channel_mappings.items():
-            if user_id not in pair_stats:
-                pair_stats[user_id] = {}
-            for pair_name in pairs:
-                pair_stats[user_id][pair_name] = {
-                    'forwarded': 0, 'edited': 0, 'deleted': 0, 'blocked': 0, 'queued': 0, 'last_activity': None
-                }
-    except FileNotFoundError:
-        logger.info("No existing mappings file found. Starting fresh.")
+            for pair_name, mapping in pairs.items():
+                reset_pair_stats(user_id, pair_name)
+                saved = snapshot.get(user_id, {}).get(pair_name)
+                if saved:
+                    pair_stats[user_id][pair_name].update(saved.get('totals', {}))
+                    if saved.get('series'):
+                        pair_series[(user_id, pair_name)] = PairSeries.from_dict(saved['series'])
+                pair_json_cache[(user_id, pair_name)] = json.dumps(mapping)
     except Exception as e:
         logger.error(f"Error loading mappings: {e}")
+    rebuild_routing_index()
+    rebuild_filter_plans()
+
+PAIR_DEFAULTS = {
+    'active': True,
+    'remove_mentions': False,
+    'blacklist': [],
+    'block_urls': False,
+    'blacklist_urls': [],
+    'header_pattern': '',
+    'footer_pattern': '',
+    'custom_header': '',
+    'custom_footer': '',
+    'blocked_sentences': [],
+    'dedup': False
+}
+
+def file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def validate_settings(data):
+    """Check CONFIG_FILE contents and return the full settings they describe; raises ValueError."""
+    if not isinstance(data, dict):
+        raise ValueError("config must be a JSON object")
+    problems = []
+    for name, value in data.items():
+        if name not in RELOADABLE_SETTINGS:
+            problems.append(f"{name}: not a reloadable setting")
+            continue
+        kind, minimum = RELOADABLE_SETTINGS[name]
+        allowed = (int,) if kind is int else (int, float)
+        if isinstance(value, bool) or not isinstance(value, allowed):
+            problems.append(f"{name}: expected {kind.__name__}, got {json.dumps(value)}")
+        elif value < minimum:
+            problems.append(f"{name}: must be at least {minimum}")
+    if problems:
+        raise ValueError("; ".join(problems))
+    return {**DEFAULT_SETTINGS, **data}
+
+def apply_settings(settings):
+    """Swap in validated settings and bring live state in line; returns the names that changed."""
+    global fanout_semaphore
+    changed = [name for name, value in settings.items() if globals()[name] != value]
+    globals().update((name, settings[name]) for name in changed)
+    if {'DESTINATION_RATE_LIMIT', 'DESTINATION_BURST', 'GLOBAL_RATE_LIMIT', 'GLOBAL_BURST'} & set(changed):
+        send_scheduler.retune()
+    if 'MAX_MAPPING_HISTORY' in changed:
+        message_store.resize(MAX_MAPPING_HISTORY)
+    if 'PHRASE_AUTOMATON_THRESHOLD' in changed:
+        rebuild_filter_plans()
+    if 'MAX_FANOUT_CONCURRENCY' in changed:
+        # Sends holding the old semaphore finish under it; new ones use the new limit
+        fanout_semaphore = asyncio.Semaphore(MAX_FANOUT_CONCURRENCY)
+    return changed
+
+def reload_settings():
+    """Re-read CONFIG_FILE and apply it all or nothing; returns the changed names."""
+    watched_mtimes[CONFIG_FILE] = file_mtime(CONFIG_FILE)
+    try:
+        with open(CONFIG_FILE, "r") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        data = {}
+    except json.JSONDecodeError as e:
+        raise ValueError(f"{CONFIG_FILE} is not valid JSON: {e}")
+    changed = apply_settings(validate_settings(data))
+    if changed:
+        logger.info(f"Settings reloaded: {', '.join(f'{name}={globals()[name]}' for name in changed)}")
+    return changed
+
+def validate_mappings(data):
+    if not isinstance(data, dict):
+        raise ValueError("mappings must be a JSON object of users")
+    problems = []
+    for user_id, pairs in data.items():
+        if not isinstance(pairs, dict):
+            problems.append(f"user {user_id}: pairs must be an object")
+            continue
+        for pair_name, mapping in pairs.items():
+            if not isinstance(mapping, dict):
+                problems.append(f"{pair_name}: must be an object")
+                continue
+            for field in ('source', 'destination'):
+                try:
+                    int(mapping[field])
+                except (KeyError, TypeError, ValueError):
+                    problems.append(f"{pair_name}: invalid {field} {json.dumps(mapping.get(field))}")
+    if problems:
+        raise ValueError("; ".join(problems[:10]) + (f" (+{len(problems) - 10} more)" if len(problems) > 10 else ""))
+    return {
+        user_id: {pair_name: with_pair_defaults(mapping) for pair_name, mapping in pairs.items()}
+        for user_id, pairs in data.items()
+    }
+
+def with_pair_defaults(mapping):
+    missing = {key: value for key, value in PAIR_DEFAULTS.items() if key not in mapping}
+    return {**mapping, **copy.deepcopy(missing)}
+
+async def reload_mappings():
+    """Replace the pairs with MAPPINGS_FILE (or the database) as edited outside the bot.
+
+    Returns (added, changed, removed) pair counts, or None while the bot's own
+    unsaved changes are pending. Batches already queued finish with the pair
+    settings they were routed with.
+    """
+    global channel_mappings
+    if dirty_mappings or (mapping_save_task is not None and not mapping_save_task.done()):
+        return None
+    if MAPPINGS_BACKEND == "sqlite":
+        data = await asyncio.to_thread(load_mappings_from_db)
+    else:
+        watched_mtimes[MAPPINGS_FILE] = file_mtime(MAPPINGS_FILE)
+        try:
+            with open(MAPPINGS_FILE, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{MAPPINGS_FILE} is not valid JSON: {e}")
+    mappings = validate_mappings(data)
+
+    old_keys = {(u, p) for u, pairs in channel_mappings.items() for p in pairs}
+    new_keys = {(u, p) for u, pairs in mappings.items() for p in pairs}
+    added = new_keys - old_keys
+    changed = {key for key in new_keys & old_keys if json.dumps(mappings[key[0]][key[1]]) != pair_json_cache.get(key)}
+    removed = old_keys - new_keys
+    # Stats of removed pairs stay until restart so batches already routed to them can still count
+    for user_id, pair_name in added:
+        reset_pair_stats(user_id, pair_name)
+        message_store.forget_mark(user_id, pair_name)
+    for user_id, pair_name in changed:
+        old, new = channel_mappings[user_id][pair_name], mappings[user_id][pair_name]
+        # Moving or resuming a pair restarts it from live traffic
+        if str(old.get('source')) != str(new.get('source')) or (new.get('active') and not old.get('active')):
+            message_store.forget_mark(user_id, pair_name)
+    pair_json_cache.clear()
+    pair_json_cache.update(
+        ((user_id, pair_name), json.dumps(mapping)) for user_id, pairs in mappings.items() for pair_name, mapping in pairs.items()
+    )
+    channel_mappings = mappings
+    rebuild_routing_index()
+    rebuild_filter_plans()
+    if added or changed:
+        touched = [mappings[user_id][pair_name] for user_id, pair_name in added | changed]
+        await resolve_peers(pair_chat_ids(touched))
+    if added or changed or removed:
+        logger.info(f"Mappings reloaded: {len(added)} added, {len(changed)} changed, {len(removed)} removed")
+    return len(added), len(changed), len(removed)
+
+async def report_rejected_config(path, error):
+    logger.error(f"Rejected change to {path}: {error}")
+    if NOTIFY_CHAT_ID:
+        # A failed notice must not take the watcher down with it
+        try:
+            await send_scheduler.send_message(NOTIFY_CHAT_ID, render_emoji(f"⚠️ Rejected change to {path}: {error}"))
+        except Exception as e:
+            logger.error(f"Error sending config rejection notice: {e}")
+
+async def watch_config():
+    """Apply outside edits to CONFIG_FILE and MAPPINGS_FILE; a rejected edit leaves everything as it was."""
+    while True:
+        await asyncio.sleep(CONFIG_POLL_INTERVAL)
+        # A rejected file is not retried until it changes again
+        if file_mtime(CONFIG_FILE) != watched_mtimes.get(CONFIG_FILE):
+            try:
+                reload_settings()
+            except Exception as e:
+                await report_rejected_config(CONFIG_FILE, e)
+        if MAPPINGS_BACKEND == "json" and file_mtime(MAPPINGS_FILE) != watched_mtimes.get(MAPPINGS_FILE):
+            try:
+                if await reload_mappings() is None:
+                    logger.info(f"Change to {MAPPINGS_FILE} waits for pending mapping saves")
+            except Exception as e:
+                await report_rejected_config(MAPPINGS_FILE, e)
+
+async def resend_queued_for_destination(items):
+    # Refetch each source's messages in one call, then resend strictly in queue order
+    parked = send_scheduler.parked_for(items[0][3])
+    if parked > MAX_FLOOD_WAIT:
+        # Later items for this destination wait behind the first one
+        await retry_queue.defer(items[0][0], parked)
+        return
+    fetched = {}
+    by_source = {}
+    for item in items:
+        by_source.setdefault(item[1], []).append(item[2])
+    shard = destination_shards.get(items[0][3], 'main')  # Every item shares one destination
+    for source, msg_ids in by_source.items():
+        try:
+            messages = await shard_client(shard).get_messages(input_peer(source, shard), ids=msg_ids)
+            fetched.update(((source, msg_id), message) for msg_id, message in zip(msg_ids, messages))
+        except Exception as e:
+            logger.warning(f"Could not refetch queued messages from {source}: {e}")
+
+    for item_id, source, source_msg_id, destination, user_id, pair_name, attempts in items:
+        mapping = channel_mappings.get(user_id, {}).get(pair_name)
+        if mapping is None:
+            logger.info(f"Dropping queued message {source_msg_id}: pair '{pair_name}' no longer exists")
+            await retry_queue.remove(item_id)
+            continue
+        if not mapping['active']:
+            await retry_queue.reschedule(item_id, attempts)
+            return
+        if (source, source_msg_id) in fetched and fetched[(source, source_msg_id)] is None:
+            logger.info(f"Dropping queued message {source_msg_id}: deleted from source {source}")
+            await retry_queue.remove(item_id)
+            continue
+
+        message = fetched.get((source, source_msg_id))
+        success = False
+        if message is not None:
+            event = SimpleNamespace(chat_id=source, message=message)
+            success = await forward_message_with_retry(event, mapping, user_id, pair_name)
+        if success:
+            await retry_queue.remove(item_id)
+            continue
+
+        attempts += 1
+        if attempts >= RETRY_QUEUE_MAX_ATTEMPTS:
+            logger.error(f"Giving up on queued message {source_msg_id} for '{pair_name}' after {attempts} attempts")
+            await retry_queue.remove(item_id)
+            if NOTIFY_CHAT_ID:
+                await send_scheduler.send_message(
+                    NOTIFY_CHAT_ID,
+                    f"⚠️ Error: Dropped queued message {source_msg_id} for pair '{pair_name}' after {attempts} attempts."
+                )
+            continue
+        await retry_queue.reschedule(item_id, attempts)
+        return  # later items for this destination wait behind this one
 
 async def process_message_queue():
-    while message_queue and is_connected:
-        message_data = message_queue.popleft()
-        await forward_message_with_retry(*message_data)
+    if retry_drain_lock.locked():
+        return
+    async with retry_drain_lock:
+        while is_connected:
+            groups = await retry_queue.due_by_destination(MAX_QUEUE_SIZE)
+            if not groups:
+                break
+            pending = asyncio.Queue()
+            for items in groups.values():
+                pending.put_nowait(items)
+
+            async def worker():
+                while not pending.empty():
+                    items = pending.get_nowait()
+                    try:
+                        await resend_queued_for_destination(items)
+                    except Exception as e:
+                        logger.error(f"Error draining retry queue for {items[0][3]}: {e}")
+
+            await asyncio.gather(*(worker() for _ in range(min(RETRY_QUEUE_WORKERS, len(groups)))))
+            await retry_queue.refresh_stats()
+            if sum(len(items) for items in groups.values()) < MAX_QUEUE_SIZE:
+                break
+
+async def drain_retry_queue():
+    while True:
+        await asyncio.sleep(RETRY_QUEUE_POLL_INTERVAL)
+        if is_connected and retry_queue.depth:
+            await process_message_queue()
 
 def render_emoji(text):
     """Convert emoji text to actual emoji images."""
@@ -90,16 +1393,14 @@ def check_blocked_sentences(text, blocked_sentences):
 def filter_urls(text, block_urls, blacklist_urls=None):
     if not text or not block_urls:
         return text, True
-    import re
-    url_pattern = r'https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+(?:/[^\s]*)?'
-    urls = re.findall(url_pattern, text)
     if blacklist_urls:
-        for url in urls:
-            if any(blacklisted in url for blacklisted in blacklist_urls):
+        for url in URL_PATTERN.findall(text):
+            url_lower = url.lower()
+            if any(blacklisted in url_lower for blacklisted in blacklist_urls):
                 text = text.replace(url, '[URL BLOCKED]')
         return text, True
     else:
-        text = re.sub(url_pattern, '[URL REMOVED]', text)
+        text = URL_PATTERN.sub('[URL REMOVED]', text)
         return text, False
 
 def remove_header_footer(text, header_pattern, footer_pattern):
@@ -121,82 +1422,349 @@ def apply_custom_header_footer(text, custom_header, custom_footer):
         result = f"{result.rstrip()}\n{custom_footer}"
     return result.strip()
 
+def build_phrase_matcher(blacklist, blocked_sentences):
+    """Build a case-insensitive matcher over blacklist words and blocked sentences.
+
+    Short lists are scanned with str.find; larger ones get an Aho-Corasick
+    automaton so a message is matched in one pass regardless of list size.
+    """
+    patterns = [(w.lower(), None) for w in blacklist if w]
+    patterns += [(s.lower(), s) for s in blocked_sentences if s]
+    if not patterns:
+        return None
+    if len(patterns) < PHRASE_AUTOMATON_THRESHOLD:
+        return {
+            'words': [phrase for phrase, sentence in patterns if sentence is None],
+            'sentences': [(phrase, sentence) for phrase, sentence in patterns if sentence is not None],
+            'goto': None,
+        }
+
+    # Trie; each output entry is (length, sentence), sentence is None for blacklist words
+    goto = [{}]
+    out = [()]
+    for phrase, sentence in patterns:
+        state = 0
+        for ch in phrase:
+            next_state = goto[state].get(ch)
+            if next_state is None:
+                next_state = len(goto)
+                goto[state][ch] = next_state
+                goto.append({})
+                out.append(())
+            state = next_state
+        out[state] += ((len(phrase), sentence),)
+
+    # Breadth-first pass to set failure links and merge suffix outputs
+    fail = [0] * len(goto)
+    queue = deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for ch, next_state in goto[state].items():
+            queue.append(next_state)
+            fallback = fail[state]
+            while fallback and ch not in goto[fallback]:
+                fallback = fail[fallback]
+            fail[next_state] = goto[fallback].get(ch, 0)
+            out[next_state] += out[fail[next_state]]
+
+    return {'goto': goto, 'fail': fail, 'out': out}
+
+def scan_phrases(matcher, text):
+    """Return (first blocked sentence or None, blacklist spans) for text."""
+    lowered = text.lower()
+    spans = []
+    if matcher['goto'] is None:
+        for phrase, sentence in matcher['sentences']:
+            if phrase in lowered:
+                return sentence, []
+        for word in matcher['words']:
+            start = lowered.find(word)
+            while start != -1:
+                spans.append((start, start + len(word)))
+                start = lowered.find(word, start + 1)
+    else:
+        goto, fail, out = matcher['goto'], matcher['fail'], matcher['out']
+        state = 0
+        for i, ch in enumerate(lowered):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, sentence in out[state]:
+                if sentence is not None:
+                    return sentence, []
+                spans.append((i - length + 1, i + 1))
+
+    if spans and len(lowered) != len(text):
+        # A few characters lowercase to more than one; map spans back to the original text
+        origin = [i for i, ch in enumerate(text) for _ in ch.lower()]
+        spans = [(origin[start], origin[end - 1] + 1) for start, end in spans]
+    return None, spans
+
+def mask_spans(text, spans, mask="***"):
+    # Leftmost-longest, non-overlapping, matching filter_blacklisted_words for ordinary lists
+    pieces = []
+    pos = 0
+    for start, end in sorted(spans, key=lambda span: (span[0], -span[1])):
+        if start < pos:
+            continue
+        pieces.append(text[pos:start])
+        pieces.append(mask)
+        pos = end
+    pieces.append(text[pos:])
+    return "".join(pieces)
+
+def compile_filter_plan(mapping):
+    """Precompile a pair's filters so the per-message path does no setup work."""
+    return {
+        'phrases': build_phrase_matcher(mapping.get('blacklist') or [], mapping.get('blocked_sentences') or []),
+        'block_urls': mapping.get('block_urls', False),
+        'blacklist_urls': frozenset(u.lower() for u in mapping.get('blacklist_urls') or [] if u),
+        'header_pattern': mapping.get('header_pattern', ''),
+        'footer_pattern': mapping.get('footer_pattern', ''),
+        'remove_mentions': mapping.get('remove_mentions', False),
+        'custom_header': mapping.get('custom_header', ''),
+        'custom_footer': mapping.get('custom_footer', ''),
+        'config': json.dumps(mapping),  # What a filter process compiles the same plan from
+        'version': next(filter_plan_versions),
+    }
+
+def refresh_filter_plan(user_id, pair_name):
+    mapping = channel_mappings.get(user_id, {}).get(pair_name)
+    if mapping is None:
+        filter_plans.pop((user_id, pair_name), None)
+    else:
+        filter_plans[(user_id, pair_name)] = compile_filter_plan(mapping)
+
+def drop_filter_plans(user_id):
+    for key in [k for k in filter_plans if k[0] == user_id]:
+        del filter_plans[key]
+
+def rebuild_filter_plans():
+    filter_plans.clear()
+    for user_id, pairs in channel_mappings.items():
+        for pair_name, mapping in pairs.items():
+            filter_plans[(user_id, pair_name)] = compile_filter_plan(mapping)
+
+def get_filter_plan(user_id, pair_name, mapping):
+    plan = filter_plans.get((user_id, pair_name))
+    if plan is None:
+        plan = filter_plans[(user_id, pair_name)] = compile_filter_plan(mapping)
+    return plan
+
+def apply_filter_plan(plan, message):
+    """Run a compiled filter plan over a message.
+
+    Returns (block_reason, text, entities, allow_preview); block_reason is None
+    when the message should be sent.
+    """
+    raw_text = message.raw_text
+    message_text = raw_text or ""
+    original_entities = message.entities or []
+    media = message.media
+
+    # Enable previews for URLs or webpages
+    allow_preview = isinstance(media, MessageMediaWebPage) or any(
+        isinstance(e, (MessageEntityTextUrl, MessageEntityUrl))
+        for e in original_entities
+    )
+
+    # Apply blocked sentences and blacklist filters in one pass
+    if plan['phrases'] and message_text:
+        blocked_sentence, spans = scan_phrases(plan['phrases'], message_text)
+        if blocked_sentence is not None:
+            return f"blocked sentence '{blocked_sentence}'", message_text, None, allow_preview
+        if spans:
+            message_text = mask_spans(message_text, spans)
+            if message_text.strip() == "***":
+                return "blacklist filter", message_text, None, allow_preview
+
+    # Apply URL filter
+    if plan['block_urls'] or plan['blacklist_urls']:
+        message_text, allow_preview = filter_urls(message_text, plan['block_urls'], plan['blacklist_urls'])
+
+    # Apply header/footer removal
+    if (plan['header_pattern'] or plan['footer_pattern']) and message_text:
+        message_text = remove_header_footer(message_text, plan['header_pattern'], plan['footer_pattern'])
+
+    # Apply mention removal
+    if plan['remove_mentions'] and message_text:
+        message_text = MENTION_PATTERN.sub('', message_text)
+        message_text = WHITESPACE_PATTERN.sub(' ', message_text).strip()
+
+    # Skip if message is empty after filtering
+    if not message_text.strip() and not media:
+        return "empty after filtering", message_text, None, allow_preview
+
+    # Apply custom header/footer
+    message_text = apply_custom_header_footer(message_text, plan['custom_header'], plan['custom_footer'])
+
+    # Entity offsets are only valid for the untouched text
+    if message_text != raw_text:
+        original_entities = None
+
+    return None, render_emoji(message_text), original_entities or None, allow_preview
+
+def filtered_message(plan, message, user_id, pair_name):
+    result = prefiltered.get((user_id, pair_name, id(message)))
+    return result if result is not None else apply_filter_plan(plan, message)
+
+def filter_in_worker(plans, messages):
+    """Filter process entry point: each pair's results for a batch of messages.
+
+    plans are (key, version, config). config is None unless the caller knows
+    this process may not have the plan yet; a pair whose current version is
+    not cached then gets None back, and the caller resends it with its config.
+    The processes hold nothing else, so the pool can be resized or restarted freely.
+    """
+    results = []
+    for key, version, config in plans:
+        cached = worker_plans.get(key)
+        if cached is None or cached[0] != version:
+            if config is None:
+                results.append(None)
+                continue
+            if key not in worker_plans and len(worker_plans) >= FILTER_WORKER_PLAN_CACHE:
+                worker_plans.clear()
+            cached = worker_plans[key] = (version, compile_filter_plan(json.loads(config)))
+        results.append([apply_filter_plan(cached[1], message) for message in messages])
+    return results
+
+async def filter_share(share, messages):
+    # Plans travel by key and version; a config is only shipped to a process that lacks it
+    plans = [(route[:2], get_filter_plan(*route)) for route in share]
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(
+        filter_pool, filter_in_worker, [(key, plan['version'], None) for key, plan in plans], messages
+    )
+    missed = [i for i, result in enumerate(results) if result is None]
+    if missed:
+        resent = await loop.run_in_executor(
+            filter_pool, filter_in_worker,
+            [(plans[i][0], plans[i][1]['version'], plans[i][1]['config']) for i in missed], messages
+        )
+        for i, result in zip(missed, resent):
+            results[i] = result
+    return results
+
+async def prefilter(events, routes):
+    """Filter a batch for its pairs on the filter pool, one share of the pairs per process.
+
+    Results land in `prefiltered` under the returned keys; the caller drops them
+    when done. Without a pool, or if it fails, sending filters in-process.
+    """
+    if filter_pool is None:
+        return []
+    # Only what apply_filter_plan reads; Telethon messages carry their client and do not pickle
+    messages = [
+        SimpleNamespace(raw_text=event.message.raw_text, entities=event.message.entities, media=event.message.media)
+        for event in events
+    ]
+    shares = [routes[i::FILTER_WORKERS] for i in range(min(FILTER_WORKERS, len(routes)))]
+    try:
+        share_results = await asyncio.gather(*(filter_share(share, messages) for share in shares))
+    except Exception as e:
+        filter_pool_stats['errors'] += 1
+        logger.warning(f"Filter pool failed, filtering in-process: {e}")
+        return []
+    filter_pool_stats['batches'] += 1
+    filter_pool_stats['messages'] += len(events)
+    keys = []
+    for share, results in zip(shares, share_results):
+        for (user_id, pair_name, _), pair_results in zip(share, results):
+            for event, result in zip(events, pair_results):
+                key = (user_id, pair_name, id(event.message))
+                prefiltered[key] = result
+                keys.append(key)
+    return keys
+
+def start_filter_pool():
+    global filter_pool
+    if FILTER_WORKERS <= 0 or filter_pool is not None:
+        return
+    filter_pool = ProcessPoolExecutor(FILTER_WORKERS)
+    # Fork the processes now, before the client's connections and threads exist
+    filter_pool.submit(int).result()
+    logger.info(f"Filtering on {FILTER_WORKERS} worker process(es)")
+
+def stop_filter_pool():
+    global filter_pool
+    if filter_pool is not None:
+        filter_pool.shutdown(cancel_futures=True)
+        filter_pool = None
+
+def is_plain_mirror(message, message_text):
+    # Filters left the message as-is, so a server-side forward produces the same output
+    return (
+        message_text == (message.raw_text or "")
+        and (not message.media or isinstance(message.media, (MessageMediaPhoto, MessageMediaDocument, MessageMediaWebPage)))
+    )
+
+def note_forward_error(source, error):
+    if isinstance(error, errors.ChatForwardsRestrictedError) and source not in forward_restricted:
+        forward_restricted.add(source)
+        logger.info(f"Source {source} restricts forwarding, copying its messages from now on")
+
+def can_forward_natively(plan, message, user_id, pair_name):
+    block_reason, message_text, _, _ = filtered_message(plan, message, user_id, pair_name)
+    return block_reason is None and not message.reply_to and is_plain_mirror(message, message_text)
+
+async def forward_natively(events, mapping, user_id, pair_name):
+    """Forward messages from one source without the author header, in one request.
+
+    Returns the events Telegram did not forward, e.g. ones deleted at the source meanwhile.
+    """
+    sent_messages = await send_scheduler.forward_messages(
+        int(mapping['destination']),
+        [event.message.id for event in events],
+        from_peer=input_peer(events[0].chat_id, mapping_shard(mapping)),
+        drop_author=True,
+        silent=events[0].message.silent
+    )
+    if not isinstance(sent_messages, list):
+        sent_messages = [sent_messages]
+    sent_messages = sent_messages + [None] * (len(events) - len(sent_messages))
+    forwarded = 0
+    unsent = []
+    for event, sent_message in zip(events, sent_messages):
+        if sent_message is None:
+            unsent.append(event)
+            continue
+        await store_message_mapping(event, mapping, sent_message)
+        record_send_latency(user_id, pair_name, event.message)
+        forwarded += 1
+    record_pair_event(user_id, pair_name, 'forwarded', forwarded)
+    record_pair_event(user_id, pair_name, 'fast_path', forwarded)
+    pair_stats[user_id][pair_name]['last_activity'] = datetime.now().isoformat()
+    logger.info(f"{forwarded} message(s) forwarded natively from {mapping['source']} to {mapping['destination']}")
+    return unsent
+
 async def forward_message_with_retry(event, mapping, user_id, pair_name):
+    plan = get_filter_plan(user_id, pair_name, mapping)
     for attempt in range(MAX_RETRIES):
         try:
-            message_text = event.message.raw_text or ""
-            original_entities = event.message.entities or []
             media = event.message.media
-            is_webpage = isinstance(media, MessageMediaWebPage)
-
-            # Check for link entities or webpage previews
-            has_links = any(
-                isinstance(e, (MessageEntityTextUrl, MessageEntityUrl))
-                for e in original_entities
+            block_reason, message_text, original_entities, allow_preview = filtered_message(
+                plan, event.message, user_id, pair_name
             )
-            allow_preview = is_webpage or has_links  # Enable previews for URLs or webpages
-
-            # Apply blocked sentences filter
-            if mapping.get('blocked_sentences'):
-                should_block, matching_sentence = check_blocked_sentences(message_text, mapping['blocked_sentences'])
-                if should_block:
-                    logger.info(f"Message blocked due to blocked sentence: '{matching_sentence}'")
-                    pair_stats[user_id][pair_name]['blocked'] += 1
-                    return True
-
-            # Apply blacklist filter
-            if mapping.get('blacklist') and message_text:
-                message_text = filter_blacklisted_words(message_text, mapping['blacklist'])
-                if message_text.strip() == "***":
-                    logger.info("Message entirely blocked due to blacklist filter")
-                    pair_stats[user_id][pair_name]['blocked'] += 1
-                    return True
-
-            # Apply URL filter
-            if mapping.get('block_urls', False) or mapping.get('blacklist_urls'):
-                message_text, allow_preview = filter_urls(
-                    message_text,
-                    mapping.get('block_urls', False),
-                    mapping.get('blacklist_urls')
-                )
-                if message_text != event.message.raw_text and original_entities:
-                    original_entities = None
-
-            # Apply header/footer removal
-            if (mapping.get('header_pattern') or mapping.get('footer_pattern')) and message_text:
-                message_text = remove_header_footer(
-                    message_text, mapping.get('header_pattern', ''), mapping.get('footer_pattern', '')
-                )
-                if message_text != event.message.raw_text:
-                    original_entities = None
-
-            # Apply mention removal
-            if mapping.get('remove_mentions', False) and message_text:
-                import re
-                message_text = re.sub(r'@[a-zA-Z0-9_]+|\[([^\]]+)\]\(tg://user\?id=\d+\)', '', message_text)
-                message_text = re.sub(r'\s+', ' ', message_text).strip()
-                if message_text != event.message.raw_text:
-                    original_entities = None
-
-            # Skip if message is empty after filtering
-            if not message_text.strip() and not media:
-                logger.info("Message skipped: empty after filtering")
-                pair_stats[user_id][pair_name]['blocked'] += 1
+            if block_reason:
+                logger.info(f"Message blocked for '{pair_name}': {block_reason}")
+                record_pair_event(user_id, pair_name, 'blocked')
                 return True
 
-            # Apply custom header/footer
-            message_text = apply_custom_header_footer(
-                message_text, mapping.get('custom_header', ''), mapping.get('custom_footer', '')
-            )
-            if message_text != event.message.raw_text:
-                original_entities = None
-
-            # Render emojis
-            message_text = render_emoji(message_text)
-
             # Handle replies
             reply_to = await handle_reply_mapping(event, mapping)
 
+            if reply_to is None and event.chat_id not in forward_restricted and is_plain_mirror(event.message, message_text):
+                try:
+                    if not await forward_natively([event], mapping, user_id, pair_name):
+                        return True
+                except errors.FloodWaitError:
+                    raise
+                except errors.RPCError as e:
+                    # The copy below needs no forwarding rights
+                    note_forward_error(event.chat_id, e)
+                    logger.warning(f"Native forward failed for '{pair_name}', copying instead: {e}")
+
             # Prepare send parameters
             send_params = {
                 'entity': int(mapping['destination']),
@@ -204,27 +1772,32 @@ async def forward_message_with_retry(event, mapping, user_id, pair_name):
                 'link_preview': allow_preview,
                 'reply_to': reply_to,
                 'silent': event.message.silent,
-                'formatting_entities': original_entities if original_entities else None,
+                'formatting_entities': original_entities,
                 'parse_mode': None
             }
 
             # Only include 'file' for supported media types
             if media and isinstance(media, (MessageMediaPhoto, MessageMediaDocument)):
-                send_params['file'] = media
-            elif is_webpage:
+                send_params['file'] = resolve_media(media)
+            elif isinstance(media, MessageMediaWebPage):
                 logger.info("Processing MessageMediaWebPage, using text and preview only")
 
-            sent_message = await client.send_message(**send_params)
+            sent_message = await send_scheduler.send_message(**send_params)
             await store_message_mapping(event, mapping, sent_message)
-            pair_stats[user_id][pair_name]['forwarded'] += 1
+            record_send_latency(user_id, pair_name, event.message)
+            record_pair_event(user_id, pair_name, 'forwarded')
             pair_stats[user_id][pair_name]['last_activity'] = datetime.now().isoformat()
             logger.info(f"Message forwarded from {mapping['source']} to {mapping['destination']} (ID: {sent_message.id})")
             return True
 
+        except errors.FileReferenceExpiredError:
+            logger.info(f"File reference of message {event.message.id} expired, refreshing it")
+            if attempt == MAX_RETRIES - 1 or not await refresh_media([event], mapping):
+                return False
         except errors.FloodWaitError as e:
-            wait_time = e.seconds
-            logger.warning(f"Flood wait error, sleeping for {wait_time} seconds...")
-            await asyncio.sleep(wait_time)
+            # The scheduler already parked the destination; leave the message to the retry queue
+            logger.warning(f"Flood wait of {e.seconds} seconds for '{pair_name}', queueing message")
+            return False
         except (errors.RPCError, ConnectionError) as e:
             logger.warning(f"Attempt {attempt + 1} failed: {e}")
             if attempt < MAX_RETRIES - 1:
@@ -232,7 +1805,7 @@ async def forward_message_with_retry(event, mapping, user_id, pair_name):
             else:
                 logger.error(f"Failed to forward message after {MAX_RETRIES} attempts: {e}")
                 if NOTIFY_CHAT_ID:
-                    await client.send_message(
+                    await send_scheduler.send_message(
                         NOTIFY_CHAT_ID,
                         f"⚠️ Error: Failed to forward message for pair '{pair_name}' after {MAX_RETRIES} attempts. Error: {e}"
                     )
@@ -240,148 +1813,252 @@ async def forward_message_with_retry(event, mapping, user_id, pair_name):
         except Exception as e:
             logger.error(f"Unexpected error forwarding message: {e}", exc_info=True)
             if NOTIFY_CHAT_ID:
-                await client.send_message(
+                await send_scheduler.send_message(
                     NOTIFY_CHAT_ID,
                     f"⚠️ Unexpected Error: Pair '{pair_name}' failed. Error: {e}"
                 )
             return False
 
 async def edit_forwarded_message(event, mapping, user_id, pair_name):
+    forwarded_msg_id = None
     try:
-        mapping_key = f"{mapping['source']}:{event.message.id}"
-        if not hasattr(client, 'forwarded_messages'):
-            logger.warning("No forwarded_messages attribute found on client")
-            return
-        if mapping_key not in client.forwarded_messages:
+        mapping_key = message_mapping_key(mapping, event.message.id)
+        forwarded_msg_id = await message_store.get(mapping_key)
+        if forwarded_msg_id is None:
             logger.warning(f"No mapping found for message: {mapping_key}")
             return
 
-        forwarded_msg_id = client.forwarded_messages[mapping_key]
-        forwarded_msg = await client.get_messages(int(mapping['destination']), ids=forwarded_msg_id)
-        if not forwarded_msg:
-            logger.warning(f"Forwarded message {forwarded_msg_id} not found in destination {mapping['destination']}")
-            del client.forwarded_messages[mapping_key]
-            return
-
-        message_text = event.message.raw_text or ""
-        original_entities = event.message.entities or []
         media = event.message.media
-        is_webpage = isinstance(media, MessageMediaWebPage)
-        has_links = any(
-            isinstance(e, (MessageEntityTextUrl, MessageEntityUrl))
-            for e in original_entities
+        plan = get_filter_plan(user_id, pair_name, mapping)
+        block_reason, message_text, original_entities, allow_preview = filtered_message(
+            plan, event.message, user_id, pair_name
         )
-        allow_preview = is_webpage or has_links
-
-        if mapping.get('blocked_sentences'):
-            should_block, matching_sentence = check_blocked_sentences(message_text, mapping['blocked_sentences'])
-            if should_block:
-                await client.delete_messages(int(mapping['destination']), [forwarded_msg_id])
-                logger.info(f"Forwarded message {forwarded_msg_id} deleted due to blocked sentence: '{matching_sentence}'")
-                pair_stats[user_id][pair_name]['blocked'] += 1
-                pair_stats[user_id][pair_name]['deleted'] += 1
-                return
-
-        if mapping.get('blacklist') and message_text:
-            message_text = filter_blacklisted_words(message_text, mapping['blacklist'])
-            if message_text.strip() == "***":
-                await client.delete_messages(int(mapping['destination']), [forwarded_msg_id])
-                logger.info(f"Forwarded message {forwarded_msg_id} deleted due to blacklist filter")
-                pair_stats[user_id][pair_name]['blocked'] += 1
-                pair_stats[user_id][pair_name]['deleted'] += 1
-                return
-
-        if mapping.get('block_urls', False) or mapping.get('blacklist_urls'):
-            message_text, allow_preview = filter_urls(
-                message_text, 
-                mapping.get('block_urls', False), 
-                mapping.get('blacklist_urls')
-            )
-            if message_text != event.message.raw_text:
-                original_entities = None
-
-        if (mapping.get('header_pattern') or mapping.get('footer_pattern')) and message_text:
-            message_text = remove_header_footer(
-                message_text, mapping.get('header_pattern', ''), mapping.get('footer_pattern', '')
-            )
-            if message_text != event.message.raw_text:
-                original_entities = None
-
-        if mapping.get('remove_mentions', False) and message_text:
-            import re
-            message_text = re.sub(r'@[a-zA-Z0-9_]+|\[([^\]]+)\]\(tg://user\?id=\d+\)', '', message_text)
-            message_text = re.sub(r'\s+', ' ', message_text).strip()
-            if message_text != event.message.raw_text:
-                original_entities = None
-
-        if not message_text.strip() and not media:
-            await client.delete_messages(int(mapping['destination']), [forwarded_msg_id])
-            logger.info(f"Forwarded message {forwarded_msg_id} deleted: empty after filtering")
-            pair_stats[user_id][pair_name]['blocked'] += 1
-            pair_stats[user_id][pair_name]['deleted'] += 1
+        if block_reason:
+            await send_scheduler.delete_messages(int(mapping['destination']), [forwarded_msg_id])
+            logger.info(f"Forwarded message {forwarded_msg_id} deleted: {block_reason}")
+            record_pair_event(user_id, pair_name, 'blocked')
+            record_pair_event(user_id, pair_name, 'deleted')
             return
 
-        message_text = apply_custom_header_footer(
-            message_text, mapping.get('custom_header', ''), mapping.get('custom_footer', '')
-        )
-        if message_text != event.message.raw_text:
-            original_entities = None
-
-        message_text = render_emoji(message_text)
-
         edit_params = {
             'entity': int(mapping['destination']),
             'message': forwarded_msg_id,
             'text': message_text,
             'link_preview': allow_preview,
-            'formatting_entities': original_entities if original_entities else None,
+            'formatting_entities': original_entities,
             'parse_mode': None
         }
         if media and isinstance(media, (MessageMediaPhoto, MessageMediaDocument)):
-            edit_params['file'] = media
-        elif is_webpage:
+            edit_params['file'] = resolve_media(media)
+        elif isinstance(media, MessageMediaWebPage):
             logger.info("Editing MessageMediaWebPage, using text and preview only")
 
-        await client.edit_message(**edit_params)
-        pair_stats[user_id][pair_name]['edited'] += 1
+        try:
+            await send_scheduler.edit_message(**edit_params)
+        except errors.FileReferenceExpiredError:
+            if 'file' not in edit_params or not await refresh_media([event], mapping):
+                raise
+            edit_params['file'] = resolve_media(event.message.media)
+            await send_scheduler.edit_message(**edit_params)
+        record_pair_event(user_id, pair_name, 'edited')
         pair_stats[user_id][pair_name]['last_activity'] = datetime.now().isoformat()
         logger.info(f"Forwarded message {forwarded_msg_id} edited in {mapping['destination']}")
 
+    except errors.MessageNotModifiedError:
+        logger.info(f"Forwarded message {forwarded_msg_id} already up to date")
     except errors.MessageAuthorRequiredError:
         logger.error(f"Cannot edit message {forwarded_msg_id}: Bot must be the original author")
     except errors.MessageIdInvalidError:
         logger.error(f"Cannot edit message {forwarded_msg_id}: Message ID is invalid or deleted")
-        if mapping_key in client.forwarded_messages:
-            del client.forwarded_messages[mapping_key]
-    except errors.FloodWaitError as e:
-        logger.warning(f"Flood wait error while editing, sleeping for {e.seconds} seconds...")
-        await asyncio.sleep(e.seconds)
+        message_store.delete(mapping_key)
+    except errors.FloodWaitError:
+        raise  # apply_coalesced_edit retries after the wait
     except Exception as e:
         logger.error(f"Error editing forwarded message {forwarded_msg_id}: {e}")
 
-async def delete_forwarded_message(event, mapping, user_id, pair_name):
-    try:
-        mapping_key = f"{mapping['source']}:{event.message.id}"
-        if not hasattr(client, 'forwarded_messages'):
-            logger.warning("No forwarded_messages attribute found on client")
+async def delete_forwarded_messages(destination, entries):
+    """Delete forwarded copies from one destination in bulk.
+
+    entries are (mapping_key, forwarded_msg_id, user_id, pair_name). A chunk
+    the API rejects is retried one ID at a time so messages that are already
+    gone don't fail the rest. On a FloodWait the remaining entries keep their
+    mappings and are deleted once the destination is no longer parked.
+    """
+    for i in range(0, len(entries), MAX_DELETE_BATCH):
+        chunk = entries[i:i + MAX_DELETE_BATCH]
+        deleted = chunk
+        flood_wait = None
+        try:
+            await send_scheduler.delete_messages(destination, [entry[1] for entry in chunk])
+        except errors.FloodWaitError as e:
+            defer_deletions(destination, entries[i:], e.seconds)
             return
-        if mapping_key not in client.forwarded_messages:
-            logger.warning(f"No mapping found for deleted message: {mapping_key}")
+        except (errors.MessageIdInvalidError, errors.MessageDeleteForbiddenError) as e:
+            logger.warning(f"Bulk delete in {destination} rejected ({e}), retrying individually")
+            deleted = []
+            for j, entry in enumerate(chunk):
+                try:
+                    await send_scheduler.delete_messages(destination, [entry[1]])
+                    deleted.append(entry)
+                except errors.FloodWaitError as e:
+                    flood_wait = e.seconds
+                    chunk = chunk[:j]
+                    break
+                except errors.RPCError as e:
+                    logger.warning(f"Cannot delete message {entry[1]}: {e}")
+        except Exception as e:
+            logger.error(f"Error deleting forwarded messages from {destination}: {e}")
+            continue
+
+        for mapping_key, _, _, _ in chunk:
+            message_store.delete(mapping_key)
+        now = datetime.now().isoformat()
+        for _, _, user_id, pair_name in deleted:
+            record_pair_event(user_id, pair_name, 'deleted')
+            pair_stats[user_id][pair_name]['last_activity'] = now
+        logger.info(f"{len(deleted)} forwarded message(s) deleted from {destination}")
+        if flood_wait is not None:
+            defer_deletions(destination, entries[i + len(chunk):], flood_wait)
             return
 
-        forwarded_msg_id = client.forwarded_messages[mapping_key]
-        await client.delete_messages(int(mapping['destination']), [forwarded_msg_id])
-        pair_stats[user_id][pair_name]['deleted'] += 1
-        pair_stats[user_id][pair_name]['last_activity'] = datetime.now().isoformat()
-        logger.info(f"Forwarded message {forwarded_msg_id} deleted from {mapping['destination']}")
-        del client.forwarded_messages[mapping_key]
+def defer_deletions(destination, entries, seconds):
+    # The scheduler has parked the destination; each pair retries its own
+    # entries through its worker once the park is over
+    logger.warning(f"Flood wait of {seconds} seconds deleting from {destination}, {len(entries)} deletion(s) deferred")
+    by_pair = {}
+    for entry in entries:
+        by_pair.setdefault((entry[2], entry[3]), []).append(entry)
+    for (user_id, pair_name), pair_entries in by_pair.items():
+        task = asyncio.create_task(delete_later(user_id, pair_name, destination, pair_entries, seconds))
+        delete_timers.add(task)
+        task.add_done_callback(delete_timers.discard)
+
+async def delete_later(user_id, pair_name, destination, entries, delay):
+    await asyncio.sleep(delay)
+    mapping = channel_mappings.get(user_id, {}).get(pair_name)
+    if mapping is None:
+        logger.info(f"Pair '{pair_name}' was removed; dropping {len(entries)} deferred deletion(s)")
+        return
+    await enqueue_for_pair(user_id, pair_name, mapping, 'retry_delete', (destination, entries))
+
+async def propagate_deletions(event, routes):
+    # One store lookup for every deleted ID on every pair, then bulk deletes per destination
+    keys = {}
+    for user_id, pair_name, mapping in routes:
+        for deleted_id in event.deleted_ids:
+            mapping_key = message_mapping_key(mapping, deleted_id)
+            pending_edits.pop(mapping_key, None)
+            keys[mapping_key] = (user_id, pair_name)
+    found = await message_store.get_many(list(keys))
+    if not found:
+        logger.info(f"No mappings found for {len(event.deleted_ids)} deleted message(s) in {event.chat_id}")
+        return
 
-    except errors.MessageIdInvalidError:
-        logger.warning(f"Cannot delete message {forwarded_msg_id}: Already deleted or invalid")
-        if mapping_key in client.forwarded_messages:
-            del client.forwarded_messages[mapping_key]
+    by_destination = {}
+    for mapping_key, forwarded_msg_id in found.items():
+        user_id, pair_name = keys[mapping_key]
+        by_destination.setdefault(mapping_key[1], []).append((mapping_key, forwarded_msg_id, user_id, pair_name))
+    await asyncio.gather(*(
+        delete_forwarded_messages(destination, entries) for destination, entries in by_destination.items()
+    ))
+
+def message_mapping_key(mapping, source_msg_id):
+    # Destination is part of the key so one source can feed several pairs
+    return int(mapping['source']), int(mapping['destination']), source_msg_id
+
+def media_id(media):
+    if isinstance(media, MessageMediaPhoto) and media.photo:
+        return media.photo.id
+    if isinstance(media, MessageMediaDocument) and media.document:
+        return media.document.id
+    return None
+
+def media_cache_key(media):
+    if isinstance(media, MessageMediaPhoto) and getattr(media.photo, 'access_hash', None) is not None:
+        return 'photo', media.photo.id, media.photo.access_hash, bool(media.spoiler)
+    if isinstance(media, MessageMediaDocument) and getattr(media.document, 'access_hash', None) is not None:
+        return 'document', media.document.id, media.document.access_hash, bool(media.spoiler)
+    return None
+
+def resolve_media(media, refresh=False):
+    """Input media for a photo/document, resolved once and shared by every destination."""
+    key = media_cache_key(media)
+    if key is None:
+        return media
+    if not refresh and key in media_cache:
+        media_cache.move_to_end(key)
+        media_cache_stats['hits'] += 1
+        return media_cache[key]
+    media_cache_stats['misses'] += 1
+    input_media = utils.get_input_media(media)
+    remember_bounded(media_cache, key, input_media, MEDIA_CACHE_SIZE)
+    return input_media
+
+async def refresh_media(events, mapping):
+    """Refetch source messages whose file reference expired and re-cache just their media."""
+    shard = mapping_shard(mapping)
+    try:
+        messages = await shard_client(shard).get_messages(
+            input_peer(events[0].chat_id, shard), ids=[event.message.id for event in events]
+        )
     except Exception as e:
-        logger.error(f"Error deleting forwarded message: {e}")
+        logger.warning(f"Could not refresh media from {events[0].chat_id}: {e}")
+        return False
+    for event, message in zip(events, messages):
+        if message is None or not message.media:
+            return False
+        event.message.media = message.media
+        resolve_media(message.media, refresh=True)
+        media_cache_stats['refreshed'] += 1
+    return True
+
+def message_fingerprint(message):
+    text = WHITESPACE_PATTERN.sub(' ', message.raw_text or '').strip().lower()
+    media_key = media_id(message.media)
+    if not text and media_key is None:
+        return None
+    return hash((text, media_key))
+
+def remember_bounded(index, key, value, limit):
+    index[key] = value
+    index.move_to_end(key)
+    if len(index) > limit:
+        index.popitem(last=False)
+
+def is_duplicate(destination, message, now):
+    """True if the destination got the same content within DEDUP_WINDOW; otherwise claims it."""
+    while recent_content:
+        if now - next(iter(recent_content.values())) < DEDUP_WINDOW:
+            break
+        recent_content.popitem(last=False)
+    fingerprint = message_fingerprint(message)
+    if fingerprint is None:
+        return False
+    if (destination, fingerprint) in recent_content:
+        return True
+    remember_bounded(recent_content, (destination, fingerprint), now, DEDUP_MAX_ENTRIES)
+    return False
+
+def remember_content(destination, message):
+    fingerprint = message_fingerprint(message)
+    if fingerprint is not None:
+        remember_bounded(recent_content, (destination, fingerprint), time.time(), DEDUP_MAX_ENTRIES)
+
+def release_content(destination, message):
+    # Undo is_duplicate()'s claim for content that was not delivered after all
+    fingerprint = message_fingerprint(message)
+    if fingerprint is not None:
+        recent_content.pop((destination, fingerprint), None)
+
+def remember_source_message(event):
+    fingerprint = message_fingerprint(event.message)
+    if fingerprint is not None:
+        remember_bounded(source_fingerprints, (event.chat_id, event.message.id), fingerprint, REPLY_INDEX_SIZE)
+
+def remember_reply_target(event, mapping, sent_message):
+    fingerprint = message_fingerprint(event.message)
+    if fingerprint is not None:
+        remember_bounded(reply_targets, (int(mapping['destination']), fingerprint), sent_message.id, REPLY_INDEX_SIZE)
 
 async def handle_reply_mapping(event, mapping):
     if not hasattr(event.message, 'reply_to') or not event.message.reply_to:
@@ -390,14 +2067,35 @@ async def handle_reply_mapping(event, mapping):
         source_reply_id = event.message.reply_to.reply_to_msg_id
         if not source_reply_id:
             return None
-        mapping_key = f"{mapping['source']}:{source_reply_id}"
-        if hasattr(client, 'forwarded_messages') and mapping_key in client.forwarded_messages:
-            return client.forwarded_messages[mapping_key]
-        replied_msg = await client.get_messages(int(mapping['source']), ids=source_reply_id)
+        forwarded_reply_id = await message_store.get(message_mapping_key(mapping, source_reply_id))
+        if forwarded_reply_id is not None:
+            reply_lookup_stats['mapped'] += 1
+            return forwarded_reply_id
+
+        # Same content already sent to this destination, e.g. through another pair
+        destination = int(mapping['destination'])
+        fingerprint = source_fingerprints.get((int(mapping['source']), source_reply_id))
+        if fingerprint is not None:
+            target = reply_targets.get((destination, fingerprint))
+            if target is not None:
+                reply_lookup_stats['indexed'] += 1
+                return target
+            reply_lookup_stats['unresolved'] += 1
+            return None
+
+        # Replied-to message predates our index; fall back to the API
+        reply_lookup_stats['rpc'] += 1
+        shard = mapping_shard(mapping)
+        replied_msg = await shard_client(shard).get_messages(input_peer(int(mapping['source']), shard), ids=source_reply_id)
+        if replied_msg:
+            target = reply_targets.get((destination, message_fingerprint(replied_msg)))
+            if target is not None:
+                return target
         if replied_msg and replied_msg.text:
-            dest_msgs = await client.get_messages(int(mapping['destination']), search=replied_msg.text[:20], limit=5)
+            dest_msgs = await shard_client(shard).get_messages(input_peer(destination, shard), search=replied_msg.text[:20], limit=5)
             if dest_msgs:
                 return dest_msgs[0].id
+        reply_lookup_stats['unresolved'] += 1
     except Exception as e:
         logger.error(f"Error handling reply mapping: {e}")
     return None
@@ -406,17 +2104,21 @@ async def store_message_mapping(event, mapping, sent_message):
     try:
         if not hasattr(event.message, 'id'):
             return
-        if not hasattr(client, 'forwarded_messages'):
-            client.forwarded_messages = {}
-        if len(client.forwarded_messages) >= MAX_MAPPING_HISTORY:
-            oldest_key = next(iter(client.forwarded_messages))
-            client.forwarded_messages.pop(oldest_key)
-        source_msg_id = event.message.id
-        mapping_key = f"{mapping['source']}:{source_msg_id}"
-        client.forwarded_messages[mapping_key] = sent_message.id
+        message_store.put(message_mapping_key(mapping, event.message.id), sent_message.id)
+        remember_reply_target(event, mapping, sent_message)
+        if mapping.get('dedup'):
+            remember_content(int(mapping['destination']), event.message)  # e.g. a retry-queue resend
     except Exception as e:
         logger.error(f"Error storing message mapping: {e}")
 
+def average_ms(total_seconds, count):
+    return f"{total_seconds / count * 1000:.1f}ms" if count else 'N/A'
+
+def queue_age():
+    if not retry_queue.depth or retry_queue.oldest is None:
+        return 'N/A'
+    return f"{int(time.time() - retry_queue.oldest)}s"
+
 async def send_split_message(event, full_message):
     if len(full_message) <= MAX_MESSAGE_LENGTH:
         await event.reply(render_emoji(full_message))
@@ -453,7 +2155,10 @@ async def list_commands(event):
     - `/startpair <name>` - Resume a pair
     - `/clearpairs` - Remove all pairs
     - `/togglementions <name>` - Toggle mention removal
+    - `/togglededup <name>` - Toggle dropping repeated content per destination
+    - `/setshard <name> <account|auto>` - Pin a pair to an account
     - `/monitor` - View pair stats
+    - `/reloadconfig` - Re-read the settings and mappings files
 
     📋 Filters
     - `/addblacklist <name> <word1,word2,...>` - Blacklist words
@@ -486,21 +2191,39 @@ async def monitor_pairs(event):
         return
 
     header = render_emoji("📊 Forwarding Monitor\n════════════════════\n")
-    footer = render_emoji(f"\n════════════════════\n📥 Total Queued: {len(message_queue)}")
+    footer = render_emoji(
+        f"\n════════════════════\n📥 Total Queued: {retry_queue.depth} | Oldest: {queue_age()}"
+        f"\n↩️ Replies: Mapped: {reply_lookup_stats['mapped']} | Indexed: {reply_lookup_stats['indexed']}"
+        f" | RPC: {reply_lookup_stats['rpc']} | Unresolved: {reply_lookup_stats['unresolved']}"
+        f"\n⚙️ Workers: {len(source_workers)} | Pair workers: {len(pair_workers)}"
+        f" | Backlog: {sum(q.qsize() for q in source_queues.values()) + sum(q.qsize() for q in pair_queues.values())}"
+        f" | Backpressured: {dispatch_stats['backpressured']}"
+        f" | Filter processes: {FILTER_WORKERS if filter_pool else 0}"
+        f"\n⏱️ Handler: avg {average_ms(dispatch_stats['handler_seconds'], dispatch_stats['dispatched'])}"
+        f" / max {dispatch_stats['handler_max'] * 1000:.1f}ms"
+        f" | Processing: avg {average_ms(dispatch_stats['process_seconds'], dispatch_stats['processed'])}"
+        f" / max {dispatch_stats['process_max'] * 1000:.1f}ms"
+        f"\n🖼️ Media cache: {len(media_cache)} | Hits: {media_cache_stats['hits']}"
+        f" | Misses: {media_cache_stats['misses']} | Refreshed: {media_cache_stats['refreshed']}"
+        f"\n💾 Saves: {mapping_save_stats['saves']} | Last: {mapping_save_stats['last_seconds'] * 1000:.1f}ms,"
+        f" {mapping_save_stats['last_bytes']} bytes | Total: {mapping_save_stats['bytes']} bytes"
+        + (f"\n👥 Accounts: {format_shard_load()}" if shard_clients else "")
+    )
     report = []
     for pair_name, data in channel_mappings[user_id].items():
-        stats = pair_stats.get(user_id, {}).get(pair_name, {
-            'forwarded': 0, 'edited': 0, 'deleted': 0, 'blocked': 0, 'queued': 0, 'last_activity': None
-        })
+        stats = pair_stats.get(user_id, {}).get(pair_name) or new_pair_stats()
         last_activity = stats['last_activity'] or 'N/A'
         if len(last_activity) > 20:
             last_activity = last_activity[:17] + "..."
+        send_stats = send_scheduler.stats.get(int(data['destination']), {'sent': 0, 'flood_waits': 0, 'parked_seconds': 0})
         report.append(
             render_emoji(
                 f"🔹 {pair_name}\n"
                 f"   ↳ Route: {data['source']} → {data['destination']}\n"
                 f"   ↳ Status: {'✅ Active' if data['active'] else '⏸️ Paused'}\n"
-                f"   ↳ Stats: Fwd: {stats['forwarded']} | Edt: {stats['edited']} | Del: {stats['deleted']} | Blk: {stats['blocked']} | Que: {stats['queued']}\n"
+                f"   ↳ Stats: Fwd: {stats['forwarded']} (Fast: {stats['fast_path']}) | Edt: {stats['edited']} (Saved: {stats['edits_coalesced']}) | Del: {stats['deleted']} | Blk: {stats['blocked']} | Dup: {stats['deduplicated']} | Que: {stats['queued']}\n"
+                f"   ↳ Sends: {send_stats['sent']} | FloodWaits: {send_stats['flood_waits']} | Parked: {send_stats['parked_seconds']}s\n"
+                f"   ↳ Rate: {format_pair_series(user_id, pair_name)}\n"
                 f"   ↳ Last: {last_activity}\n"
                 f"───────────────"
             )
@@ -515,25 +2238,23 @@ async def set_pair(event):
     remove_mentions = remove_mentions == "yes"
     if user_id not in channel_mappings:
         channel_mappings[user_id] = {}
-    if user_id not in pair_stats:
-        pair_stats[user_id] = {}
     channel_mappings[user_id][pair_name] = {
         'source': source,
         'destination': destination,
-        'active': True,
-        'remove_mentions': remove_mentions,
-        'blacklist': [],
-        'block_urls': False,
-        'blacklist_urls': [],
-        'header_pattern': '',
-        'footer_pattern': '',
-        'custom_header': '',
-        'custom_footer': '',
-        'blocked_sentences': []
+        **copy.deepcopy(PAIR_DEFAULTS),
+        'remove_mentions': remove_mentions
     }
-    pair_stats[user_id][pair_name] = {'forwarded': 0, 'edited': 0, 'deleted': 0, 'blocked': 0, 'queued': 0, 'last_activity': None}
-    save_mappings()
-    await event.reply(render_emoji(f"✅ Pair '{pair_name}' Added\n{source} → {destination}\nMentions: {'❌' if remove_mentions else '✔️'}"))
+    reset_pair_stats(user_id, pair_name)
+    message_store.forget_mark(user_id, pair_name)
+    rebuild_routing_index()
+    refresh_filter_plan(user_id, pair_name)
+    save_mappings(user_id, pair_name)
+    await resolve_peers(pair_chat_ids([channel_mappings[user_id][pair_name]]), force=True)
+    problems = peer_problems(channel_mappings[user_id][pair_name])
+    await event.reply(render_emoji(
+        f"✅ Pair '{pair_name}' Added\n{source} → {destination}\nMentions: {'❌' if remove_mentions else '✔️'}"
+        + (f"\n{problems.rstrip()}" if problems else "")
+    ))
 
 @client.on(events.NewMessage(pattern=r'/blocksentence (\S+) (.+)'))
 async def block_sentence(event):
@@ -541,7 +2262,8 @@ async def block_sentence(event):
     user_id = str(event.sender_id)
     if user_id in channel_mappings and pair_name in channel_mappings[user_id]:
         channel_mappings[user_id][pair_name].setdefault('blocked_sentences', []).append(sentence)
-        save_mappings()
+        refresh_filter_plan(user_id, pair_name)
+        save_mappings(user_id, pair_name)
         await event.reply(render_emoji(f"🚫 Blocked Sentence Added for '{pair_name}'"))
     else:
         await event.reply(render_emoji("⚠️ Pair not found"))
@@ -552,7 +2274,8 @@ async def clear_block_sentences(event):
     user_id = str(event.sender_id)
     if user_id in channel_mappings and pair_name in channel_mappings[user_id]:
         channel_mappings[user_id][pair_name]['blocked_sentences'] = []
-        save_mappings()
+        refresh_filter_plan(user_id, pair_name)
+        save_mappings(user_id, pair_name)
         await event.reply(render_emoji(f"🗑️ Blocked Sentences Cleared for '{pair_name}'"))
     else:
         await event.reply(render_emoji("⚠️ Pair not found"))
@@ -578,7 +2301,8 @@ async def add_blacklist(event):
     if user_id in channel_mappings and pair_name in channel_mappings[user_id]:
         channel_mappings[user_id][pair_name].setdefault('blacklist', []).extend([w.strip() for w in words])
         channel_mappings[user_id][pair_name]['blacklist'] = list(set(channel_mappings[user_id][pair_name]['blacklist']))
-        save_mappings()
+        refresh_filter_plan(user_id, pair_name)
+        save_mappings(user_id, pair_name)
         await event.reply(render_emoji(f"🚫 Added {len(words)} Word(s) to blacklist for '{pair_name}'"))
     else:
         await event.reply(render_emoji("⚠️ Pair not found"))
@@ -589,7 +2313,8 @@ async def clear_blacklist(event):
     user_id = str(event.sender_id)
     if user_id in channel_mappings and pair_name in channel_mappings[user_id]:
         channel_mappings[user_id][pair_name]['blacklist'] = []
-        save_mappings()
+        refresh_filter_plan(user_id, pair_name)
+        save_mappings(user_id, pair_name)
         await event.reply(render_emoji(f"🗑️ Blacklist Cleared for '{pair_name}'"))
     else:
         await event.reply(render_emoji("⚠️ Pair not found"))
@@ -615,7 +2340,8 @@ async def toggle_url_block(event):
     if user_id in channel_mappings and pair_name in channel_mappings[user_id]:
         current_status = channel_mappings[user_id][pair_name].get('block_urls', False)
         channel_mappings[user_id][pair_name]['block_urls'] = not current_status
-        save_mappings()
+        refresh_filter_plan(user_id, pair_name)
+        save_mappings(user_id, pair_name)
         status = "ENABLED" if not current_status else "DISABLED"
         await event.reply(render_emoji(f"🔗 URL Blocking {status} for '{pair_name}'"))
     else:
@@ -628,7 +2354,8 @@ async def add_url_blacklist(event):
     if user_id in channel_mappings and pair_name in channel_mappings[user_id]:
         channel_mappings[user_id][pair_name].setdefault('blacklist_urls', []).extend([u.strip() for u in urls])
         channel_mappings[user_id][pair_name]['blacklist_urls'] = list(set(channel_mappings[user_id][pair_name]['blacklist_urls']))
-        save_mappings()
+        refresh_filter_plan(user_id, pair_name)
+        save_mappings(user_id, pair_name)
         await event.reply(render_emoji(f"🚫 Added {len(urls)} URL(s) to blacklist for '{pair_name}'"))
     else:
         await event.reply(render_emoji("⚠️ Pair not found"))
@@ -639,7 +2366,8 @@ async def clear_url_blacklist(event):
     user_id = str(event.sender_id)
     if user_id in channel_mappings and pair_name in channel_mappings[user_id]:
         channel_mappings[user_id][pair_name]['blacklist_urls'] = []
-        save_mappings()
+        refresh_filter_plan(user_id, pair_name)
+        save_mappings(user_id, pair_name)
         await event.reply(render_emoji(f"🗑️ URL Blacklist Cleared for '{pair_name}'"))
     else:
         await event.reply(render_emoji("⚠️ Pair not found"))
@@ -650,7 +2378,8 @@ async def set_header(event):
     user_id = str(event.sender_id)
     if user_id in channel_mappings and pair_name in channel_mappings[user_id]:
         channel_mappings[user_id][pair_name]['header_pattern'] = pattern
-        save_mappings()
+        refresh_filter_plan(user_id, pair_name)
+        save_mappings(user_id, pair_name)
         await event.reply(render_emoji(f"✂️ Header Set for '{pair_name}': '{pattern}'"))
     else:
         await event.reply(render_emoji("⚠️ Pair not found"))
@@ -661,7 +2390,8 @@ async def set_footer(event):
     user_id = str(event.sender_id)
     if user_id in channel_mappings and pair_name in channel_mappings[user_id]:
         channel_mappings[user_id][pair_name]['footer_pattern'] = pattern
-        save_mappings()
+        refresh_filter_plan(user_id, pair_name)
+        save_mappings(user_id, pair_name)
         await event.reply(render_emoji(f"✂️ Footer Set for '{pair_name}': '{pattern}'"))
     else:
         await event.reply(render_emoji("⚠️ Pair not found"))
@@ -673,7 +2403,8 @@ async def clear_header_footer(event):
     if user_id in channel_mappings and pair_name in channel_mappings[user_id]:
         channel_mappings[user_id][pair_name]['header_pattern'] = ''
         channel_mappings[user_id][pair_name]['footer_pattern'] = ''
-        save_mappings()
+        refresh_filter_plan(user_id, pair_name)
+        save_mappings(user_id, pair_name)
         await event.reply(render_emoji(f"🗑️ Header/Footer Cleared for '{pair_name}'"))
     else:
         await event.reply(render_emoji("⚠️ Pair not found"))
@@ -684,7 +2415,8 @@ async def set_custom_header(event):
     user_id = str(event.sender_id)
     if user_id in channel_mappings and pair_name in channel_mappings[user_id]:
         channel_mappings[user_id][pair_name]['custom_header'] = text
-        save_mappings()
+        refresh_filter_plan(user_id, pair_name)
+        save_mappings(user_id, pair_name)
         await event.reply(render_emoji(f"📝 Custom Header Set for '{pair_name}': '{text}'"))
     else:
         await event.reply(render_emoji("⚠️ Pair not found"))
@@ -695,7 +2427,8 @@ async def set_custom_footer(event):
     user_id = str(event.sender_id)
     if user_id in channel_mappings and pair_name in channel_mappings[user_id]:
         channel_mappings[user_id][pair_name]['custom_footer'] = text
-        save_mappings()
+        refresh_filter_plan(user_id, pair_name)
+        save_mappings(user_id, pair_name)
         await event.reply(render_emoji(f"📝 Custom Footer Set for '{pair_name}': '{text}'"))
     else:
         await event.reply(render_emoji("⚠️ Pair not found"))
@@ -707,7 +2440,8 @@ async def clear_custom_header_footer(event):
     if user_id in channel_mappings and pair_name in channel_mappings[user_id]:
         channel_mappings[user_id][pair_name]['custom_header'] = ''
         channel_mappings[user_id][pair_name]['custom_footer'] = ''
-        save_mappings()
+        refresh_filter_plan(user_id, pair_name)
+        save_mappings(user_id, pair_name)
         await event.reply(render_emoji(f"🗑️ Custom Header/Footer Cleared for '{pair_name}'"))
     else:
         await event.reply(render_emoji("⚠️ Pair not found"))
@@ -719,12 +2453,67 @@ async def toggle_mentions(event):
     if user_id in channel_mappings and pair_name in channel_mappings[user_id]:
         current_status = channel_mappings[user_id][pair_name]['remove_mentions']
         channel_mappings[user_id][pair_name]['remove_mentions'] = not current_status
-        save_mappings()
+        refresh_filter_plan(user_id, pair_name)
+        save_mappings(user_id, pair_name)
         status = "ENABLED" if not current_status else "DISABLED"
         await event.reply(render_emoji(f"🔄 Mention Removal {status} for '{pair_name}'"))
     else:
         await event.reply(render_emoji("⚠️ Pair not found"))
 
+@client.on(events.NewMessage(pattern='(?i)^/togglededup (\S+)$'))
+async def toggle_dedup(event):
+    pair_name = event.pattern_match.group(1)
+    user_id = str(event.sender_id)
+    if user_id in channel_mappings and pair_name in channel_mappings[user_id]:
+        current_status = channel_mappings[user_id][pair_name].get('dedup', False)
+        channel_mappings[user_id][pair_name]['dedup'] = not current_status
+        save_mappings(user_id, pair_name)
+        status = "ENABLED" if not current_status else "DISABLED"
+        await event.reply(render_emoji(f"🔄 Duplicate Filter {status} for '{pair_name}' ({int(DEDUP_WINDOW // 60)} min window)"))
+    else:
+        await event.reply(render_emoji("⚠️ Pair not found"))
+
+@client.on(events.NewMessage(pattern='(?i)^/setshard (\S+) (\S+)$'))
+async def set_shard(event):
+    pair_name, shard = event.pattern_match.group(1), event.pattern_match.group(2)
+    user_id = str(event.sender_id)
+    if user_id not in channel_mappings or pair_name not in channel_mappings[user_id]:
+        await event.reply(render_emoji("⚠️ Pair not found"))
+        return
+    if shard != 'auto' and shard not in shard_names():
+        await event.reply(render_emoji(f"⚠️ Unknown account '{shard}'. Available: {', '.join(shard_names())}"))
+        return
+    mapping = channel_mappings[user_id][pair_name]
+    if shard == 'auto':
+        mapping.pop('shard', None)
+    else:
+        mapping['shard'] = shard
+    rebuild_routing_index()
+    save_mappings(user_id, pair_name)
+    await resolve_peers(pair_chat_ids([mapping]))
+    problems = peer_problems(mapping)
+    await event.reply(render_emoji(
+        f"👥 Pair '{pair_name}' now sends via '{mapping_shard(mapping)}'" + (f"\n{problems.rstrip()}" if problems else "")
+    ))
+
+@client.on(events.NewMessage(pattern='(?i)^/reloadconfig$'))
+async def reload_config(event):
+    lines = []
+    try:
+        changed = reload_settings()
+        lines.append(f"⚙️ Settings: {', '.join(f'{name}={globals()[name]}' for name in changed) if changed else 'no changes'}")
+    except Exception as e:
+        lines.append(f"❌ {CONFIG_FILE} rejected: {e}")
+    try:
+        counts = await reload_mappings()
+        if counts is None:
+            lines.append("⏳ Pairs: unsaved changes pending, try again in a few seconds")
+        else:
+            lines.append(f"📋 Pairs: {counts[0]} added, {counts[1]} changed, {counts[2]} removed")
+    except Exception as e:
+        lines.append(f"❌ Mappings rejected: {e}")
+    await event.reply(render_emoji("\n".join(lines)))
+
 @client.on(events.NewMessage(pattern='(?i)^/listpairs$'))
 async def list_pairs(event):
     user_id = str(event.sender_id)
@@ -741,6 +2530,8 @@ async def list_pairs(event):
                 f"   ↳ Route: {data['source']} → {data['destination']}\n"
                 f"   ↳ Active: {'✅' if data['active'] else '⏸️'}\n"
                 f"   ↳ Mentions: {'❌' if data['remove_mentions'] else '✔️'}\n"
+                f"   ↳ Dedup: {'✅' if data.get('dedup', False) else '❌'}\n"
+                f"   ↳ Account: {mapping_shard(data)}{' (pinned)' if data.get('shard') else ''}\n"
                 f"   ↳ URLs: {'🚫' if data.get('block_urls', False) else '🔗'}\n"
                 f"   ↳ URL BL: {len(data.get('blacklist_urls', []))}\n"
                 f"   ↳ Header: '{data.get('header_pattern', '') or 'None'}'\n"
@@ -748,19 +2539,33 @@ async def list_pairs(event):
                 f"   ↳ Custom H: '{data.get('custom_header', '') or 'None'}'\n"
                 f"   ↳ Custom F: '{data.get('custom_footer', '') or 'None'}'\n"
                 f"   ↳ Filters: BL: {len(data.get('blacklist', []))} | BS: {len(data.get('blocked_sentences', []))}\n"
+                f"{peer_problems(data)}"
                 f"───────────────"
             )
         )
     full_message = header + "\n".join(pairs_list)
     await send_split_message(event, full_message)
 
+def peer_problems(mapping):
+    lines = ""
+    shard = mapping_shard(mapping)
+    for field in ('source', 'destination'):
+        try:
+            error = peer_errors.get((shard, int(mapping[field])))
+        except (KeyError, TypeError, ValueError):
+            error = "not a chat ID"
+        if error:
+            lines += f"   ↳ ⚠️ Unresolved {field}: {error}\n"
+    return lines
+
 @client.on(events.NewMessage(pattern='(?i)^/pausepair (\S+)$'))
 async def pause_pair(event):
     pair_name = event.pattern_match.group(1)
     user_id = str(event.sender_id)
     if user_id in channel_mappings and pair_name in channel_mappings[user_id]:
         channel_mappings[user_id][pair_name]['active'] = False
-        save_mappings()
+        rebuild_routing_index()
+        save_mappings(user_id, pair_name)
         await event.reply(render_emoji(f"⏸️ Pair '{pair_name}' Paused"))
     else:
         await event.reply(render_emoji("⚠️ Pair not found"))
@@ -771,7 +2576,10 @@ async def start_pair(event):
     user_id = str(event.sender_id)
     if user_id in channel_mappings and pair_name in channel_mappings[user_id]:
         channel_mappings[user_id][pair_name]['active'] = True
-        save_mappings()
+        # Messages posted while paused stay skipped; catch-up only covers downtime
+        message_store.forget_mark(user_id, pair_name)
+        rebuild_routing_index()
+        save_mappings(user_id, pair_name)
         await event.reply(render_emoji(f"▶️ Pair '{pair_name}' Activated"))
     else:
         await event.reply(render_emoji("⚠️ Pair not found"))
@@ -782,57 +2590,577 @@ async def clear_pairs(event):
     if user_id in channel_mappings:
         channel_mappings[user_id] = {}
         pair_stats[user_id] = {}
-        save_mappings()
+        for key in [key for key in pair_series if key[0] == user_id]:
+            del pair_series[key]
+        rebuild_routing_index()
+        drop_filter_plans(user_id)
+        save_mappings(user_id)
         await event.reply(render_emoji("🗑️ All Pairs Cleared"))
     else:
         await event.reply(render_emoji("⚠️ No pairs to clear"))
 
+async def queue_for_retry(event, mapping, user_id, pair_name):
+    try:
+        await retry_queue.push(
+            event.chat_id, event.message.id, int(mapping['destination']), user_id, pair_name
+        )
+        record_pair_event(user_id, pair_name, 'queued')
+        logger.warning(f"Message queued for '{pair_name}'")
+    except Exception as e:
+        logger.error(f"Error queueing message for '{pair_name}': {e}")
+
+async def send_album_with_retry(events, mapping, user_id, pair_name):
+    """Send the parts of one source album as a single multi-file request."""
+    plan = get_filter_plan(user_id, pair_name, mapping)
+    parts = []
+    for event in events:
+        block_reason, message_text, original_entities, _ = filtered_message(plan, event.message, user_id, pair_name)
+        if block_reason:
+            logger.info(f"Album part {event.message.id} blocked for '{pair_name}': {block_reason}")
+            record_pair_event(user_id, pair_name, 'blocked')
+            continue
+        parts.append((event, message_text, original_entities or []))
+    if not parts:
+        return True
+
+    for attempt in range(MAX_RETRIES):
+        try:
+            reply_to = await handle_reply_mapping(parts[0][0], mapping)
+            sent_messages = await send_scheduler.send_file(
+                int(mapping['destination']),
+                [resolve_media(event.message.media) for event, _, _ in parts],
+                caption=[message_text for _, message_text, _ in parts],
+                formatting_entities=[entities for _, _, entities in parts],
+                reply_to=reply_to,
+                silent=parts[0][0].message.silent,
+                parse_mode=None
+            )
+            for (event, _, _), sent_message in zip(parts, sent_messages):
+                await store_message_mapping(event, mapping, sent_message)
+                record_send_latency(user_id, pair_name, event.message)
+            record_pair_event(user_id, pair_name, 'forwarded', len(parts))
+            pair_stats[user_id][pair_name]['last_activity'] = datetime.now().isoformat()
+            logger.info(f"Album of {len(parts)} forwarded from {mapping['source']} to {mapping['destination']}")
+            return True
+        except errors.FileReferenceExpiredError:
+            logger.info(f"File reference expired in album for '{pair_name}', refreshing it")
+            if attempt == MAX_RETRIES - 1 or not await refresh_media([event for event, _, _ in parts], mapping):
+                return False
+        except errors.FloodWaitError as e:
+            logger.warning(f"Flood wait of {e.seconds} seconds for '{pair_name}', queueing album")
+            return False
+        except (errors.RPCError, ConnectionError) as e:
+            logger.warning(f"Album attempt {attempt + 1} failed: {e}")
+            if attempt < MAX_RETRIES - 1:
+                await asyncio.sleep(RETRY_DELAY)
+        except Exception as e:
+            logger.error(f"Unexpected error forwarding album: {e}", exc_info=True)
+            return False
+    logger.error(f"Failed to forward album for '{pair_name}' after {MAX_RETRIES} attempts")
+    return False
+
+def split_albums(events):
+    # Consecutive parts sharing a grouped_id form one run; other messages are runs of one
+    runs = []
+    for event in events:
+        grouped_id = getattr(event.message, 'grouped_id', None)
+        if runs and grouped_id is not None and runs[-1][0] == grouped_id:
+            runs[-1][1].append(event)
+        else:
+            runs.append((grouped_id, [event]))
+    return [run for _, run in runs]
+
+async def forward_batch_to_pair(events, mapping, user_id, pair_name):
+    # Consecutive plain-mirror messages (albums included) go out in one native
+    # forward; the rest take the full send path, all in source order
+    high_water = message_store.last_handled(user_id, pair_name, events[0].chat_id) or 0
+    events = [event for event in events if event.message.id > high_water]  # already handled, e.g. by a catch-up
+    if not events:
+        return
+    plan = get_filter_plan(user_id, pair_name, mapping)
+    failed = []
+    batch = []
+    claimed = set()  # id() of events whose content this batch claimed for dedup
+
+    async def flush_batch():
+        if not batch:
+            return
+        try:
+            unsent = await forward_natively(batch, mapping, user_id, pair_name)
+        except errors.FloodWaitError as e:
+            # Sending one by one would only hit the same wait; the retry queue resends after it
+            logger.warning(f"Flood wait of {e.seconds} seconds for '{pair_name}', queueing {len(batch)} message(s)")
+            failed.extend(batch)
+            return
+        except Exception as e:
+            note_forward_error(batch[0].chat_id, e)
+            logger.warning(f"Native forward failed for '{pair_name}', sending individually: {e}")
+            unsent = batch
+        # Only what the forward did not deliver; the rest is already sent and stored
+        for run in split_albums(unsent):
+            await send_run(run)
+
+    async def send_run(run):
+        try:
+            if len(run) > 1:
+                success = await send_album_with_retry(run, mapping, user_id, pair_name)
+            else:
+                success = await forward_message_with_retry(run[0], mapping, user_id, pair_name)
+        except Exception as e:
+            logger.error(f"Error forwarding for '{pair_name}': {e}")
+            success = False
+        if not success:
+            failed.extend(run)
+
+    for run in split_albums(events):
+        if mapping.get('dedup'):
+            now = time.time()
+            # Parts this pair's filters block are never sent, so they must not claim the content.
+            # Check every other part so an album only counts as a repeat when all of it is
+            sendable = [event for event in run if filtered_message(plan, event.message, user_id, pair_name)[0] is None]
+            repeats = [(event, is_duplicate(int(mapping['destination']), event.message, now)) for event in sendable]
+            if sendable and all(repeat for _, repeat in repeats):
+                record_pair_event(user_id, pair_name, 'deduplicated', len(run))
+                logger.info(f"Skipped {len(run)} duplicate message(s) for '{pair_name}'")
+                continue
+            claimed.update(id(event) for event, repeat in repeats if not repeat)
+        eligible = run[0].chat_id not in forward_restricted and all(
+            can_forward_natively(plan, event.message, user_id, pair_name) for event in run
+        )
+        if eligible and (not batch or batch[0].message.silent == run[0].message.silent):
+            batch.extend(run)
+            continue
+        await flush_batch()
+        batch = list(run) if eligible else []
+        if not eligible:
+            await send_run(run)
+    await flush_batch()
+
+    for event in failed:
+        if id(event) in claimed:
+            # Let the same content through from another pair meanwhile; a successful resend claims it again
+            release_content(int(mapping['destination']), event.message)
+        await queue_for_retry(event, mapping, user_id, pair_name)
+    # Forwarded, blocked or queued for retry: either way the pair is past these
+    message_store.mark(user_id, pair_name, events[0].chat_id, max(event.message.id for event in events))
+
+def schedule_coalesced_edit(mapping_key, mapping, user_id, pair_name, delay):
+    task = asyncio.create_task(coalesce_edit_later(mapping_key, mapping, user_id, pair_name, delay))
+    edit_timers.add(task)
+    task.add_done_callback(edit_timers.discard)
+
+async def coalesce_edit_later(mapping_key, mapping, user_id, pair_name, delay):
+    # The edit goes through the pair's worker, so it runs after the original
+    # message even if that is still waiting to be sent
+    await asyncio.sleep(delay)
+    await enqueue_for_pair(user_id, pair_name, mapping, 'apply_edit', mapping_key)
+
+async def apply_coalesced_edit(mapping_key, mapping, user_id, pair_name):
+    pending = pending_edits.pop(mapping_key, None)
+    if pending is None:
+        return  # the message was deleted inside the window
+    if pending['absorbed']:
+        record_pair_event(user_id, pair_name, 'edits_coalesced', pending['absorbed'])
+        logger.info(f"Edit of {mapping_key} absorbed {pending['absorbed']} intermediate edit(s)")
+    keys = await prefilter([pending['event']], [(user_id, pair_name, mapping)])
+    try:
+        await edit_forwarded_message(pending['event'], mapping, user_id, pair_name)
+    except errors.FloodWaitError as e:
+        # Re-arm unless a newer edit already has; that one carries the latest text
+        if mapping_key not in pending_edits:
+            pending_edits[mapping_key] = {'event': pending['event'], 'absorbed': 0}
+            schedule_coalesced_edit(mapping_key, mapping, user_id, pair_name, e.seconds)
+        logger.warning(f"Flood wait of {e.seconds} seconds while editing {mapping_key}, retrying after it")
+    except Exception as e:
+        logger.error(f"Error editing for '{pair_name}': {e}")
+    finally:
+        for key in keys:
+            prefiltered.pop(key, None)
+
+async def edit_for_pair(event, mapping, user_id, pair_name):
+    # Only the latest version of a message inside the coalescing window is sent
+    mapping_key = message_mapping_key(mapping, event.message.id)
+    pending = pending_edits.get(mapping_key)
+    if pending is not None:
+        pending['event'] = event
+        pending['absorbed'] += 1
+        return
+    pending_edits[mapping_key] = {'event': event, 'absorbed': 0}
+    schedule_coalesced_edit(mapping_key, mapping, user_id, pair_name, EDIT_COALESCE_SECONDS)
+
+async def enqueue_for_pair(user_id, pair_name, mapping, kind, payload):
+    key = (user_id, pair_name)
+    queue = pair_queues.get(key)
+    if queue is None:
+        queue = pair_queues[key] = asyncio.Queue(SOURCE_QUEUE_HIGH_WATER)
+    if key not in pair_workers:
+        pair_workers[key] = asyncio.create_task(pair_worker(key, queue))
+    await queue.put((kind, payload, mapping))
+
+async def process_routed_events(kind, events, routes):
+    # Hand the work to each pair's own worker, so a destination that is slow or
+    # waiting out a FloodWait holds up only its pair, not the whole source
+    if kind == 'new':
+        for event in events:
+            remember_source_message(event)
+    for user_id, pair_name, mapping in routes:
+        if kind == 'new':
+            await enqueue_for_pair(user_id, pair_name, mapping, kind, events)
+        else:
+            for event in events:
+                await enqueue_for_pair(user_id, pair_name, mapping, kind, event)
+
+async def process_pair_item(kind, payload, mapping, user_id, pair_name):
+    if kind == 'new':
+        keys = await prefilter(payload, [(user_id, pair_name, mapping)])
+        try:
+            await forward_batch_to_pair(payload, mapping, user_id, pair_name)
+        finally:
+            for key in keys:
+                prefiltered.pop(key, None)
+    elif kind == 'edit':
+        await edit_for_pair(payload, mapping, user_id, pair_name)
+    elif kind == 'apply_edit':
+        await apply_coalesced_edit(payload, mapping, user_id, pair_name)
+    elif kind == 'retry_delete':
+        await delete_forwarded_messages(*payload)
+    else:
+        await propagate_deletions(payload, [(user_id, pair_name, mapping)])
+
+async def pair_worker(key, queue):
+    """Send one pair's new messages, edits and deletions strictly in the order its source had them."""
+    user_id, pair_name = key
+    while True:
+        try:
+            kind, payload, mapping = await asyncio.wait_for(queue.get(), SOURCE_WORKER_IDLE_TIMEOUT)
+        except asyncio.TimeoutError:
+            if queue.empty():
+                pair_workers.pop(key, None)
+                pair_queues.pop(key, None)
+                return
+            continue
+        try:
+            await process_pair_item(kind, payload, mapping, user_id, pair_name)
+        except Exception as e:
+            logger.error(f"Error processing {kind} for '{pair_name}': {e}")
+        finally:
+            queue.task_done()
+
+def group_queued_events(items):
+    # Merge runs of new messages routed the same way so they can be batched
+    groups = []
+    for kind, event, routes in items:
+        if groups and kind == 'new' and groups[-1][0] == 'new' and groups[-1][2] is routes:
+            groups[-1][1].append(event)
+        else:
+            groups.append((kind, [event], routes))
+    return groups
+
+async def source_worker(source_id, queue):
+    while True:
+        try:
+            item = await asyncio.wait_for(queue.get(), SOURCE_WORKER_IDLE_TIMEOUT)
+        except asyncio.TimeoutError:
+            if queue.empty():
+                source_workers.pop(source_id, None)
+                source_queues.pop(source_id, None)
+                return
+            continue
+        # Take whatever else has piled up so bursts are handled together, and
+        # give an album that is still arriving a moment to complete
+        items = [item]
+        while len(items) < FORWARD_BATCH_SIZE:
+            if not queue.empty():
+                items.append(queue.get_nowait())
+                continue
+            kind, event, _ = items[-1]
+            if kind != 'new' or getattr(event.message, 'grouped_id', None) is None:
+                break
+            try:
+                items.append(await asyncio.wait_for(queue.get(), ALBUM_BUFFER_SECONDS))
+            except asyncio.TimeoutError:
+                break
+        start = time.perf_counter()
+        try:
+            for kind, events, routes in group_queued_events(items):
+                try:
+                    await process_routed_events(kind, events, routes)
+                except Exception as e:
+                    logger.error(f"Error processing {kind} event from {source_id}: {e}")
+        finally:
+            for _ in items:
+                queue.task_done()
+            elapsed = time.perf_counter() - start
+            dispatch_stats['processed'] += len(items)
+            dispatch_stats['process_seconds'] += elapsed
+            dispatch_stats['process_max'] = max(dispatch_stats['process_max'], elapsed)
+            process_latency.observe(elapsed)
+
+class UpdateRecorder:
+    """Appends routed updates to a JSON-lines file that benchmarks/replay.py can feed back.
+
+    Lines are buffered on the event loop and appended by flush() from a worker thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = []
+        self.lock = threading.Lock()
+        self.recorded = 0
+
+    def record(self, kind, event):
+        try:
+            self.pending.append(json.dumps(encode_update(kind, event), ensure_ascii=False, separators=(',', ':'), default=str))
+            self.recorded += 1
+        except Exception as e:
+            logger.warning(f"Could not record {kind} update from {event.chat_id}: {e}")
+
+    def _write(self, lines):
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+
+    async def flush(self):
+        if not self.pending:
+            return
+        lines, self.pending = self.pending, []
+        try:
+            await asyncio.to_thread(self._write, lines)
+        except Exception as e:
+            logger.error(f"Error writing recorded updates: {e}")
+            self.pending = lines + self.pending
+
+    def close(self):
+        if self.pending:
+            self._write(self.pending)
+            self.pending = []
+
+update_recorder = UpdateRecorder(RECORD_FILE) if RECORD_FILE else None
+
+# Placeholders for recorded media; the filters only look at the media type
+RECORDED_MEDIA = {
+    'MessageMediaPhoto': lambda: MessageMediaPhoto(photo=None),
+    'MessageMediaDocument': lambda: MessageMediaDocument(document=None),
+    'MessageMediaWebPage': lambda: MessageMediaWebPage(webpage=tl_types.WebPageEmpty(id=0)),
+}
+
+def encode_update(kind, event):
+    record = {'t': round(time.time(), 3), 'k': kind, 'c': event.chat_id}
+    if kind == 'delete':
+        record['ids'] = list(event.deleted_ids)
+        return record
+    message = event.message
+    record['m'] = message.id
+    if message.raw_text:
+        record['x'] = message.raw_text
+    if message.entities:
+        record['e'] = [entity.to_dict() for entity in message.entities]
+    if message.media:
+        record['md'] = type(message.media).__name__
+    if getattr(message, 'grouped_id', None):
+        record['g'] = message.grouped_id
+    if message.reply_to and message.reply_to.reply_to_msg_id:
+        record['r'] = message.reply_to.reply_to_msg_id
+    if message.silent:
+        record['s'] = 1
+    return record
+
+def decode_update(record):
+    """Rebuild (kind, event) from a recorded line; the message is dated now."""
+    kind = record['k']
+    if kind == 'delete':
+        return kind, SimpleNamespace(chat_id=record['c'], deleted_ids=record['ids'])
+    entities = []
+    for data in record.get('e', []):
+        data = dict(data)
+        entities.append(getattr(tl_types, data.pop('_'))(**data))
+    media_type = record.get('md')
+    media = None
+    if media_type:
+        media = RECORDED_MEDIA[media_type]() if media_type in RECORDED_MEDIA else SimpleNamespace(type=media_type)
+    text = record.get('x', '')
+    message = SimpleNamespace(
+        id=record['m'], raw_text=text, text=text, message=text, entities=entities or None, media=media,
+        grouped_id=record.get('g'),
+        reply_to=SimpleNamespace(reply_to_msg_id=record['r']) if record.get('r') else None,
+        silent=bool(record.get('s')), date=datetime.now(timezone.utc)
+    )
+    return kind, SimpleNamespace(chat_id=record['c'], message=message)
+
+async def dispatch_event(kind, event, routes, backfill=False):
+    # Work happens in the source's worker so the Telethon handler returns at once;
+    # one worker per source keeps that source's events in order
+    start = time.perf_counter()
+    source_id = event.chat_id
+    held = backfill_holds.get(source_id)
+    if held is not None and not backfill:
+        held.append((kind, event, routes))  # dispatched once the catch-up ahead of it is queued
+        return
+    queue = source_queues.get(source_id)
+    if queue is None:
+        queue = source_queues[source_id] = asyncio.Queue(SOURCE_QUEUE_HIGH_WATER)
+    if source_id not in source_workers:
+        source_workers[source_id] = asyncio.create_task(source_worker(source_id, queue))
+    if queue.full():
+        dispatch_stats['backpressured'] += 1
+        logger.warning(f"Event queue for {source_id} at high-water mark, applying backpressure")
+    await queue.put((kind, event, routes))
+    elapsed = time.perf_counter() - start
+    dispatch_stats['dispatched'] += 1
+    dispatch_stats['handler_seconds'] += elapsed
+    dispatch_stats['handler_max'] = max(dispatch_stats['handler_max'], elapsed)
+    handler_latency.observe(elapsed)
+
 @client.on(events.NewMessage)
 async def forward_messages(event):
     if not is_connected:
         return
-    for user_id, pairs in channel_mappings.items():
-        for pair_name, mapping in pairs.items():
-            if mapping['active'] and event.chat_id == int(mapping['source']):
-                try:
-                    success = await forward_message_with_retry(event, mapping, user_id, pair_name)
-                    if not success:
-                        message_queue.append((event, mapping, user_id, pair_name))
-                        pair_stats[user_id][pair_name]['queued'] += 1
-                        logger.warning(f"Message queued for '{pair_name}'")
-                except Exception as e:
-                    logger.error(f"Error forwarding for '{pair_name}': {e}")
-                    message_queue.append((event, mapping, user_id, pair_name))
-                    pair_stats[user_id][pair_name]['queued'] += 1
-                return
+    routes = routes_for(event)
+    if not routes:
+        return
+    if update_recorder is not None:
+        update_recorder.record('new', event)
+    await dispatch_event('new', event, routes)
 
 @client.on(events.MessageEdited)
 async def handle_message_edit(event):
     if not is_connected:
         return
-    for user_id, pairs in channel_mappings.items():
-        for pair_name, mapping in pairs.items():
-            if mapping['active'] and event.chat_id == int(mapping['source']):
-                try:
-                    await edit_forwarded_message(event, mapping, user_id, pair_name)
-                except Exception as e:
-                    logger.error(f"Error editing for '{pair_name}': {e}")
-                return
+    routes = routes_for(event)
+    if not routes:
+        return
+    if update_recorder is not None:
+        update_recorder.record('edit', event)
+    await dispatch_event('edit', event, routes)
 
 @client.on(events.MessageDeleted)
 async def handle_message_deleted(event):
     if not is_connected:
         return
-    for user_id, pairs in channel_mappings.items():
-        for pair_name, mapping in pairs.items():
-            if mapping['active'] and event.chat_id == int(mapping['source']):
-                try:
-                    for deleted_id in event.deleted_ids:
-                        event.message.id = deleted_id
-                        await delete_forwarded_message(event, mapping, user_id, pair_name)
-                except Exception as e:
-                    logger.error(f"Error handling deletion for '{pair_name}': {e}")
-                return
+    routes = routes_for(event)
+    if not routes:
+        return
+    if update_recorder is not None:
+        update_recorder.record('delete', event)
+    await dispatch_event('delete', event, routes)
+
+async def start_shards():
+    """Log in the extra accounts and hook up the update handlers; accounts that fail stay off the ring."""
+    live = ['main']
+    for name, shard in shard_clients.items():
+        try:
+            await shard.start()
+        except Exception as e:
+            logger.error(f"Account '{name}' failed to start, its pairs move to the other accounts: {e}")
+            continue
+        shard.add_event_handler(forward_messages, events.NewMessage())
+        shard.add_event_handler(handle_message_edit, events.MessageEdited())
+        shard.add_event_handler(handle_message_deleted, events.MessageDeleted())
+        live.append(name)
+    rebuild_shard_ring(live)
+    rebuild_routing_index()
+    logger.info(f"Accounts online: {', '.join(live)}")
+
+def format_shard_load():
+    pairs = {name: 0 for name in sorted({name for _, name in shard_ring})}
+    for user_pairs in channel_mappings.values():
+        for mapping in user_pairs.values():
+            shard = mapping_shard(mapping)
+            pairs[shard] = pairs.get(shard, 0) + 1
+    return " | ".join(f"{name}: {count} pairs" for name, count in pairs.items())
+
+async def fetch_history_page(source, budget, shard, **kwargs):
+    while True:
+        delay = budget.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            return await shard_client(shard).get_messages(input_peer(source, shard), **kwargs)
+        except errors.FloodWaitError as e:
+            if e.seconds > BACKFILL_MAX_FLOOD_WAIT:
+                raise
+            logger.warning(f"Flood wait of {e.seconds} seconds fetching history of {source}")
+            await asyncio.sleep(e.seconds)
+
+async def backfill_shard(source, routes, budget, shard):
+    # Each account reads history itself: message and media references are per account
+    min_id = min(message_store.last_handled(user_id, pair_name, source) for user_id, pair_name, _ in routes)
+    latest = [message for message in await fetch_history_page(source, budget, shard, limit=1) if message]
+    if not latest or latest[0].id <= min_id:
+        return
+    if latest[0].id - min_id > BACKFILL_MAX_MESSAGES:
+        # Keep the newest window: skipping the oldest leaves no gap behind the live messages
+        skipped = f"{min_id + 1}-{latest[0].id - BACKFILL_MAX_MESSAGES}"
+        min_id = latest[0].id - BACKFILL_MAX_MESSAGES
+        logger.warning(f"Catch-up of {source} skipped messages {skipped} (over BACKFILL_MAX_MESSAGES)")
+        if NOTIFY_CHAT_ID:
+            await send_scheduler.send_message(
+                NOTIFY_CHAT_ID,
+                render_emoji(f"⚠️ Catch-up of {source} skipped messages {skipped} (over BACKFILL_MAX_MESSAGES).")
+            )
+    fetched = 0
+    while True:
+        page = [
+            message for message in
+            await fetch_history_page(source, budget, shard, min_id=min_id, limit=BACKFILL_PAGE_SIZE, reverse=True)
+            if message
+        ]
+        if not page:
+            break
+        for message in page:
+            # forward_batch_to_pair skips pairs already past this message
+            await dispatch_event('new', SimpleNamespace(chat_id=source, message=message), routes, backfill=True)
+        fetched += len(page)
+        min_id = page[-1].id
+        if len(page) < BACKFILL_PAGE_SIZE:
+            break
+    if fetched:
+        logger.info(f"Caught up {fetched} message(s) from {source}" + (f" via '{shard}'" if shard_clients else ""))
+
+async def backfill_source(source, routes, budget):
+    """Queue messages a source posted after its pairs' high-water marks, oldest first."""
+    by_shard = {}
+    for route in routes:
+        by_shard.setdefault(mapping_shard(route[2]), []).append(route)
+    try:
+        for shard, shard_routes_for_source in by_shard.items():
+            await backfill_shard(source, shard_routes_for_source, budget, shard)
+    except Exception as e:
+        logger.error(f"Error catching up {source}: {e}")
+    finally:
+        # Release live events in arrival order; new ones may land while we await
+        held = backfill_holds[source]
+        while held:
+            await dispatch_event(*held.pop(0), backfill=True)
+        del backfill_holds[source]
+
+async def backfill_sources(sources):
+    budget = TokenBucket(BACKFILL_REQUEST_RATE, 1)
+    semaphore = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+
+    async def run(source, routes):
+        async with semaphore:
+            await backfill_source(source, routes, budget)
+
+    await asyncio.gather(*(run(source, routes) for source, routes in sources.items()))
+
+def start_backfill():
+    """After a restart or reconnect, push everything missed since each pair's high-water mark.
+
+    Must be called as the connection comes up, before the loop yields, so no
+    live event overtakes the catch-up of its source.
+    """
+    sources = {}
+    for source, routes in source_routes.items():
+        if source in backfill_holds:
+            continue  # already catching up
+        # Pairs without a mark yet start from live traffic
+        routes = [route for route in routes if message_store.last_handled(*route[:2], source) is not None]
+        if routes:
+            sources[source] = routes
+            backfill_holds[source] = []
+    if sources:
+        asyncio.create_task(backfill_sources(sources))
 
 async def check_connection_status():
     global is_connected
@@ -841,7 +3169,8 @@ async def check_connection_status():
         if current_status and not is_connected:
             is_connected = True
             logger.info("Connection established, processing queue...")
-            await process_message_queue()
+            start_backfill()
+            asyncio.create_task(process_message_queue())
         elif not current_status and is_connected:
             is_connected = False
             logger.warning("Connection lost, queuing messages...")
@@ -864,12 +3193,165 @@ async def check_pair_inactivity():
                 last_activity = datetime.fromisoformat(last_activity_str)
                 inactivity_duration = (current_time - last_activity).total_seconds()
                 if inactivity_duration > INACTIVITY_THRESHOLD:
-                    await client.send_message(
+                    await send_scheduler.send_message(
                         NOTIFY_CHAT_ID,
-                        render_emoji(f"⚠️ Inactivity Alert: Pair '{pair_name}' has had no activity for over {INACTIVITY_THRESHOLD // 60} minutes.")
+                        render_emoji(f"⚠️ Inactivity Alert: Pair '{pair_name}' has had no activity for over {int(INACTIVITY_THRESHOLD // 60)} minutes.")
                     )
                     pair_stats[user_id][pair_name]['last_activity'] = datetime.now().isoformat()
 
+async def flush_message_store():
+    last_prune = time.time()
+    while True:
+        await asyncio.sleep(MAPPING_FLUSH_INTERVAL)
+        await message_store.flush()
+        if time.time() - last_prune >= MAPPING_PRUNE_INTERVAL:
+            last_prune = time.time()
+            try:
+                removed = await asyncio.to_thread(
+                    message_store.prune, MAPPING_RETENTION_DAYS * 86400, MAPPING_MAX_ROWS_PER_PAIR
+                )
+                logger.info(f"Pruned {removed} old message mappings")
+            except Exception as e:
+                logger.error(f"Error pruning message mappings: {e}")
+
+async def snapshot_pair_stats():
+    while True:
+        await asyncio.sleep(STATS_SNAPSHOT_INTERVAL)
+        try:
+            await asyncio.to_thread(write_stats_snapshot, collect_stats_snapshot())
+        except Exception as e:
+            logger.error(f"Error saving stats snapshot: {e}")
+
+async def measure_loop_lag():
+    # How late a sleep wakes up is how long callbacks wait behind blocking work
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(time.perf_counter() - start - LOOP_LAG_INTERVAL, 0)
+        loop_lag['last'] = lag
+        loop_lag['max'] = max(loop_lag['max'], lag)
+
+def metric_labels(**labels):
+    escaped = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+def render_histogram(lines, name, help_text, histogram):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    cumulative = 0
+    for bound, count in zip(histogram.bounds, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+    lines.append(f"{name}_sum {histogram.sum}")
+    lines.append(f"{name}_count {histogram.count}")
+
+def render_metrics(store_rows):
+    """Current state in the Prometheus text exposition format."""
+    lines = [
+        "# HELP forwardbot_pair_events_total Events handled per forwarding pair.",
+        "# TYPE forwardbot_pair_events_total counter",
+    ]
+    for user_id, pairs in pair_stats.items():
+        for pair_name, stats in pairs.items():
+            for kind, value in stats.items():
+                if kind != 'last_activity':
+                    lines.append(f"forwardbot_pair_events_total{metric_labels(user=user_id, pair=pair_name, kind=kind)} {value}")
+    lines += ["# HELP forwardbot_pair_active Whether a pair is active (1) or paused (0).", "# TYPE forwardbot_pair_active gauge"]
+    for user_id, pairs in channel_mappings.items():
+        for pair_name, mapping in pairs.items():
+            lines.append(f"forwardbot_pair_active{metric_labels(user=user_id, pair=pair_name)} {int(bool(mapping.get('active')))}")
+
+    lines += ["# HELP forwardbot_destination_sends_total Successful API calls per destination.", "# TYPE forwardbot_destination_sends_total counter"]
+    lines += [f"forwardbot_destination_sends_total{metric_labels(destination=d)} {s['sent']}" for d, s in send_scheduler.stats.items()]
+    lines += ["# HELP forwardbot_destination_flood_waits_total FloodWait errors per destination.", "# TYPE forwardbot_destination_flood_waits_total counter"]
+    lines += [f"forwardbot_destination_flood_waits_total{metric_labels(destination=d)} {s['flood_waits']}" for d, s in send_scheduler.stats.items()]
+    lines += ["# HELP forwardbot_destination_parked_seconds_total Seconds parked by FloodWaits per destination.", "# TYPE forwardbot_destination_parked_seconds_total counter"]
+    lines += [f"forwardbot_destination_parked_seconds_total{metric_labels(destination=d)} {s['parked_seconds']}" for d, s in send_scheduler.stats.items()]
+
+    oldest_age = time.time() - retry_queue.oldest if retry_queue.oldest else 0
+    lines += [
+        "# HELP forwardbot_retry_queue_depth Messages waiting in the retry queue.",
+        "# TYPE forwardbot_retry_queue_depth gauge",
+        f"forwardbot_retry_queue_depth {retry_queue.depth}",
+        "# HELP forwardbot_retry_queue_oldest_age_seconds Age of the oldest retry queue item.",
+        "# TYPE forwardbot_retry_queue_oldest_age_seconds gauge",
+        f"forwardbot_retry_queue_oldest_age_seconds {oldest_age}",
+        "# HELP forwardbot_source_backlog Events buffered in source worker queues.",
+        "# TYPE forwardbot_source_backlog gauge",
+        f"forwardbot_source_backlog {sum(q.qsize() for q in source_queues.values())}",
+        "# HELP forwardbot_source_workers Running source workers.",
+        "# TYPE forwardbot_source_workers gauge",
+        f"forwardbot_source_workers {len(source_workers)}",
+        "# HELP forwardbot_pair_backlog Items buffered in per-pair worker queues.",
+        "# TYPE forwardbot_pair_backlog gauge",
+        f"forwardbot_pair_backlog {sum(q.qsize() for q in pair_queues.values())}",
+        "# HELP forwardbot_backpressured_total Handler calls that hit a full source queue.",
+        "# TYPE forwardbot_backpressured_total counter",
+        f"forwardbot_backpressured_total {dispatch_stats['backpressured']}",
+    ]
+    render_histogram(lines, "forwardbot_handler_latency_seconds", "Time Telethon handlers spend queueing an event.", handler_latency)
+    render_histogram(lines, "forwardbot_processing_latency_seconds", "Time source workers spend on one batch.", process_latency)
+    if store_rows is not None:
+        lines += [
+            "# HELP forwardbot_message_store_rows Rows in the forwarded message mapping store.",
+            "# TYPE forwardbot_message_store_rows gauge",
+            f"forwardbot_message_store_rows {store_rows}",
+        ]
+    lines += [
+        "# HELP forwardbot_event_loop_lag_seconds Latest event-loop lag probe.",
+        "# TYPE forwardbot_event_loop_lag_seconds gauge",
+        f"forwardbot_event_loop_lag_seconds {loop_lag['last']}",
+        "# HELP forwardbot_event_loop_lag_max_seconds Worst event-loop lag since start.",
+        "# TYPE forwardbot_event_loop_lag_max_seconds gauge",
+        f"forwardbot_event_loop_lag_max_seconds {loop_lag['max']}",
+        "# HELP forwardbot_connected Whether the client is connected.",
+        "# TYPE forwardbot_connected gauge",
+        f"forwardbot_connected {int(is_connected)}",
+    ]
+    return "\n".join(lines) + "\n"
+
+async def handle_metrics_request(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode(errors="replace").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            store_rows = None
+            if message_store.conn is not None:
+                store_rows = await asyncio.to_thread(message_store.count)
+            status, body = "200 OK", render_metrics(store_rows).encode()
+        else:
+            status, body = "404 Not Found", b"Not Found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.warning(f"Error serving metrics request: {e}")
+    finally:
+        writer.close()
+
+async def start_metrics_server():
+    global metrics_server
+    if METRICS_PORT is None:
+        return
+    try:
+        metrics_server = await asyncio.start_server(handle_metrics_request, METRICS_HOST, METRICS_PORT)
+        logger.info(f"Metrics served at http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    except OSError as e:
+        logger.error(f"Cannot start metrics server: {e}")
+
+async def flush_update_recorder():
+    while True:
+        await asyncio.sleep(RECORD_FLUSH_INTERVAL)
+        await update_recorder.flush()
+
 async def send_periodic_report():
     while True:
         await asyncio.sleep(3600)
@@ -878,11 +3360,9 @@ async def send_periodic_report():
         for user_id in channel_mappings:
             header = render_emoji("📈 Hourly Report\n════════════════════\n")
             report = []
-            total_queued = len(message_queue)
+            total_queued = retry_queue.depth
             for pair_name, data in channel_mappings[user_id].items():
-                stats = pair_stats.get(user_id, {}).get(pair_name, {
-                    'forwarded': 0, 'edited': 0, 'deleted': 0, 'blocked': 0, 'queued': 0, 'last_activity': None
-                })
+                stats = pair_stats.get(user_id, {}).get(pair_name) or new_pair_stats()
                 report.append(
                     render_emoji(
                         f"🔹 {pair_name}\n"
@@ -890,20 +3370,39 @@ async def send_periodic_report():
                         f"   ↳ Status: {'Active' if data['active'] else 'Paused'}\n"
                         f"   ↳ Fwd: {stats['forwarded']} | Edt: {stats['edited']} | Del: {stats['deleted']}\n"
                         f"   ↳ Blk: {stats['blocked']} | Que: {stats['queued']}\n"
+                        f"   ↳ Rate: {format_pair_series(user_id, pair_name)}\n"
                         f"───────────────"
                     )
                 )
             full_message = header + "\n".join(report) + render_emoji(f"\n📥 Queued: {total_queued}")
             try:
-                await client.send_message(MONITOR_CHAT_ID, full_message)
+                await send_scheduler.send_message(MONITOR_CHAT_ID, full_message)
                 logger.info("Sent periodic report")
             except Exception as e:
                 logger.error(f"Error sending report: {e}")
 
 async def main():
+    try:
+        reload_settings()
+    except ValueError as e:
+        logger.error(f"Ignoring {CONFIG_FILE}: {e}")
+    start_filter_pool()
+    rebuild_shard_ring(shard_names())
     load_mappings()
+    load_peer_cache()
+    message_store.open()
+    retry_queue.open()
+    asyncio.create_task(flush_message_store())
+    asyncio.create_task(drain_retry_queue())
     asyncio.create_task(check_connection_status())
     asyncio.create_task(send_periodic_report())
+    asyncio.create_task(snapshot_pair_stats())
+    asyncio.create_task(measure_loop_lag())
+    asyncio.create_task(watch_config())
+    if update_recorder is not None:
+        asyncio.create_task(flush_update_recorder())
+        logger.info(f"Recording routed updates to {RECORD_FILE}")
+    await start_metrics_server()
     asyncio.create_task(check_pair_inactivity())
     logger.info("🚀 Bot is starting...")
 
@@ -916,7 +3415,12 @@ async def main():
             await client.sign_in(phone=phone, code=code)
 
         global is_connected, MONITOR_CHAT_ID, NOTIFY_CHAT_ID
+        if shard_clients:
+            await start_shards()
+        await resolve_peers(pair_chat_ids(m for pairs in channel_mappings.values() for m in pairs.values()))
         is_connected = client.is_connected()
+        if is_connected:
+            start_backfill()
         MONITOR_CHAT_ID = (await client.get_me()).id
         NOTIFY_CHAT_ID = MONITOR_CHAT_ID
 
@@ -930,7 +3434,23 @@ async def main():
         logger.error(f"Fatal error: {e}")
     finally:
         logger.info("Bot is shutting down...")
-        save_mappings()
+        if metrics_server is not None:
+            metrics_server.close()
+        stop_filter_pool()
+        for shard in shard_clients.values():
+            try:
+                await shard.disconnect()
+            except Exception as e:
+                logger.error(f"Error disconnecting account: {e}")
+        flush_mappings()
+        try:
+            write_stats_snapshot(collect_stats_snapshot())
+        except Exception as e:
+            logger.error(f"Error saving stats snapshot: {e}")
+        message_store.close()
+        retry_queue.close()
+        if update_recorder is not None:
+            update_recorder.close()
 
 if __name__ == "__main__":
     try: